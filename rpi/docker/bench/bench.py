@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Load and latency benchmark for the exporters and proxies, fully offline.
+
+Starts stubs.py in place of every upstream, then runs each service in turn
+as a subprocess pointed at it and drives it for --duration seconds with
+concurrent clients:
+
+- Prometheus-like: GET /metrics with an OpenMetrics Accept header and gzip,
+  every --scrape-interval seconds (0: back to back)
+- Homepage-like: GET / (the JSON widget endpoints), every --poll-interval
+  seconds; skipped for services Homepage does not read
+
+Each run reports requests, errors, p50/p99 latency and throughput per client
+kind, the upstream calls the service made during the run (counted by the
+stubs), its CPU time, and its peak RSS (VmHWM; Linux only).
+
+    python bench.py                                     # every service
+    python bench.py immich-jobs-proxy --latency 0.2 --size 2000 --prometheus 8
+    python bench.py glances-exporter --env COLLECT_MODE=bulk --json > bulk.json
+
+Run it before and after a change with the same options to compare.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOCKER_DIR = os.path.dirname(HERE)
+SHARED_DIR = os.path.join(DOCKER_DIR, "shared")
+STARTUP_TIMEOUT = 30  # seconds for a service to answer its first scrape
+
+PROMETHEUS_HEADERS = {
+    "Accept": "application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5,*/*;q=0.1",
+    "Accept-Encoding": "gzip",
+}
+HOMEPAGE_HEADERS = {"Accept": "application/json"}
+
+# service -> environment ({upstream} and {data} are filled in per run) and Homepage widget path
+SERVICES = {
+    "glances-exporter": {
+        "env": {"GLANCES_TARGETS": "local={upstream}", "FOLDER_TARGETS": "local"},
+        "homepage": None,
+    },
+    "paperless-stats-proxy": {
+        "env": {"PAPERLESS_URL": "{upstream}", "SIZE_INDEX_PATH": "{data}/size-index.db"},
+        "homepage": "/",
+    },
+    "immich-jobs-proxy": {
+        "env": {"IMMICH_URL": "{upstream}"},
+        "homepage": "/",
+    },
+    "grafana-alerts-proxy": {
+        "env": {"GRAFANA_URL": "{upstream}", "STATE_FILE": "{data}/alert-stats.json"},
+        "homepage": "/",
+    },
+    "nest-exporter": {
+        "env": {
+            "SDM_API_BASE": "{upstream}/v1",
+            "TOKEN_URL": "{upstream}/token",
+            "TOKEN_FILE": "{data}/token.json",
+            "SDM_PROJECT_ID": "bench",
+            "GOOGLE_CLIENT_ID": "bench",
+            "GOOGLE_CLIENT_SECRET": "bench",
+            "GOOGLE_REFRESH_TOKEN": "bench",
+        },
+        "homepage": "/",
+    },
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url, timeout=5):
+    """GET `url`, returning (status, body); (None, b"") if nothing answered."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except OSError:
+        return None, b""
+
+
+def wait_until(url, deadline):
+    """Poll `url` until it answers 200; return whether it did before `deadline`."""
+    while time.monotonic() < deadline:
+        if get(url)[0] == 200:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def proc_stats(pid):
+    """(CPU seconds, peak RSS bytes) of a running process from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    peak = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                peak = int(line.split()[1]) * 1024
+    return cpu, peak
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted `values` (None if empty)."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Client(threading.Thread):
+    """One keep-alive client requesting `path` until `stop` is set."""
+
+    def __init__(self, port, path, headers, interval, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.path = path
+        self.headers = headers
+        self.interval = interval
+        self.stop = stop
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        conn = None
+        next_at = time.monotonic()
+        while not self.stop.is_set():
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            start = time.perf_counter()
+            try:
+                conn.request("GET", self.path, headers=self.headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = None
+                ok = False
+            if ok:
+                self.latencies.append(time.perf_counter() - start)
+            else:
+                self.errors += 1
+            if self.interval:
+                next_at += self.interval
+                self.stop.wait(max(0, next_at - time.monotonic()))
+        if conn is not None:
+            conn.close()
+
+
+def summarize(clients, duration):
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    return {
+        "clients": len(clients),
+        "requests": len(latencies),
+        "errors": sum(client.errors for client in clients),
+        "rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+    }
+
+
+def run_service(name, upstream, args):
+    """Start `name`, drive it with the configured clients, and return its results."""
+    spec = SERVICES[name]
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as data:
+        env = dict(os.environ)
+        env.update({key: value.format(upstream=upstream, data=data) for key, value in spec["env"].items()})
+        env.update(dict(pair.split("=", 1) for pair in args.env))
+        env["PORT"] = str(port)
+        env["PYTHONPATH"] = os.pathsep.join([SHARED_DIR, os.path.join(DOCKER_DIR, name)])
+        env["PYTHONUNBUFFERED"] = "1"
+        log_path = os.path.join(data, "service.log")
+        with open(log_path, "w") as log:
+            proc = subprocess.Popen(
+                [sys.executable, os.path.join(DOCKER_DIR, name, "server.py")],
+                cwd=data, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        try:
+            base = f"http://127.0.0.1:{port}"
+            deadline = time.monotonic() + STARTUP_TIMEOUT
+            if not wait_until(f"{base}/metrics", deadline):
+                with open(log_path) as log:
+                    output = log.read()[-2000:]
+                raise RuntimeError(f"{name} did not answer /metrics within {STARTUP_TIMEOUT}s:\n{output}")
+            time.sleep(args.settle)
+            get(f"{upstream}/_calls?reset=1")
+            cpu_before, _ = proc_stats(proc.pid)
+
+            stop = threading.Event()
+            kinds = {"prometheus": [Client(port, "/metrics", PROMETHEUS_HEADERS, args.scrape_interval, stop)
+                                    for _ in range(args.prometheus)]}
+            if spec["homepage"] and args.homepage:
+                kinds["homepage"] = [Client(port, spec["homepage"], HOMEPAGE_HEADERS, args.poll_interval, stop)
+                                     for _ in range(args.homepage)]
+            started = time.monotonic()
+            for clients in kinds.values():
+                for client in clients:
+                    client.start()
+            time.sleep(args.duration)
+            stop.set()
+            for clients in kinds.values():
+                for client in clients:
+                    client.join()
+            elapsed = time.monotonic() - started
+
+            cpu_after, peak_rss = proc_stats(proc.pid)
+            calls = json.loads(get(f"{upstream}/_calls")[1] or b"{}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    return {
+        "service": name,
+        "duration": round(elapsed, 2),
+        "results": {kind: summarize(clients, elapsed) for kind, clients in kinds.items()},
+        "upstream_calls": calls,
+        "cpu_seconds": round(cpu_after - cpu_before, 2),
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def print_report(report):
+    print(f"{'service':<24}{'client':<12}{'reqs':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    for run in report:
+        for i, (kind, result) in enumerate(run["results"].items()):
+            p50 = f"{result['p50_ms']:.2f}" if result["p50_ms"] is not None else "-"
+            p99 = f"{result['p99_ms']:.2f}" if result["p99_ms"] is not None else "-"
+            print(
+                f"{run['service'] if not i else '':<24}{kind:<12}{result['requests']:>8}{result['errors']:>8}"
+                f"{result['rps']:>9.1f}{p50:>9}{p99:>9}"
+            )
+        calls = ", ".join(f"{endpoint} {count}" for endpoint, count in run["upstream_calls"].items()) or "none"
+        print(f"{'':<24}upstream calls: {calls}")
+        print(f"{'':<24}CPU {run['cpu_seconds']:.2f}s, peak RSS {run['peak_rss_bytes'] / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("services", nargs="*", help=f"services to run (default: all of {', '.join(SERVICES)})")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per service")
+    parser.add_argument("--prometheus", type=int, default=2, help="Prometheus-like clients")
+    parser.add_argument("--scrape-interval", type=float, default=0, help="seconds between scrapes per client")
+    parser.add_argument("--homepage", type=int, default=4, help="Homepage-like clients")
+    parser.add_argument("--poll-interval", type=float, default=0, help="seconds between polls per client")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every upstream response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--size", type=int, default=100, help="items in every upstream list payload")
+    parser.add_argument("--settle", type=float, default=1, help="seconds between startup and load")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra service setting")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    unknown = [name for name in args.services if name not in SERVICES]
+    if unknown:
+        parser.error(f"unknown service(s): {', '.join(unknown)}")
+
+    stub_port = free_port()
+    stubs = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "stubs.py"), "--port", str(stub_port), "--latency", str(args.latency),
+         "--jitter", str(args.jitter), "--size", str(args.size)],
+        stdout=subprocess.DEVNULL,
+    )
+    upstream = f"http://127.0.0.1:{stub_port}"
+    try:
+        if not wait_until(f"{upstream}/_calls", time.monotonic() + 10):
+            sys.exit("Upstream stubs did not start")
+        report = []
+        for name in args.services or SERVICES:
+            if not args.json:
+                print(f"Running {name} for {args.duration:g}s...", file=sys.stderr)
+            report.append(run_service(name, upstream, args))
+    finally:
+        stubs.terminate()
+        stubs.wait()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Local stand-ins for every upstream API the exporters and proxies call.
+
+One server answers all of them, so a service only needs its upstream URL
+pointed here:
+
+- Glances: GET /api/4/<plugin>, /api/4/all
+- Paperless: GET /api/documents/ (paginated), HEAD /api/documents/<id>/download/,
+  GET /api/statistics/, /api/tasks/
+- Immich: GET /api/jobs, /api/server/statistics
+- Grafana: GET /api/prometheus/grafana/api/v1/rules
+- Google: GET /v1/enterprises/<project>/devices, POST /token
+
+Every list in a payload (filesystems, documents, tasks, queues, rules,
+thermostats) holds --size items, and every response is delayed by --latency
+seconds plus up to --jitter more. Bodies are built once at startup so the
+stubs stay cheap next to the service being measured.
+
+GET /_calls returns the number of calls per endpoint (ids collapsed to :id)
+as JSON; /_calls?reset=1 also zeroes them.
+
+    python stubs.py --port 18080 --latency 0.02 --size 500
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ID_SEGMENT = re.compile(r"(?<!/api)/(?:\d+)(?=/|$)")
+
+TASK_STATUSES = ("SUCCESS", "SUCCESS", "SUCCESS", "FAILURE", "STARTED", "PENDING")
+RULE_STATES = ("inactive", "inactive", "inactive", "pending", "firing")
+SEVERITIES = ("critical", "warning", "info")
+
+
+def glances_payloads(size):
+    """Body per Glances plugin, plus /all."""
+    plugins = {
+        "cpu": {"total": 12.5, "user": 8.1, "system": 4.4, "idle": 87.5},
+        "mem": {"total": 8_000_000_000, "used": 3_200_000_000, "percent": 40.0},
+        "load": {"min1": 0.52, "min5": 0.41, "min15": 0.33, "cpucore": 4},
+        "fs": [
+            {"mnt_point": f"/mnt/disk{i}", "used": 10**9 * i, "size": 10**12, "percent": i % 100}
+            for i in range(size)
+        ],
+        "network": [
+            {"interface_name": f"eth{i}", "bytes_recv_rate_per_sec": 1000 + i, "bytes_sent_rate_per_sec": 500 + i}
+            for i in range(size)
+        ],
+        "sensors": [{"type": "temperature_core", "label": f"core{i}", "value": 40 + i % 20} for i in range(size)],
+        "folders": [{"path": f"/rootfs/share/folder{i}", "size": 10**8 * i} for i in range(size)],
+    }
+    payloads = {f"/api/4/{name}": json.dumps(data).encode() for name, data in plugins.items()}
+    payloads["/api/4/all"] = json.dumps(plugins).encode()
+    return payloads
+
+
+def paperless_payloads(size):
+    mime_types = ("application/pdf", "image/jpeg", "image/png", "text/plain")
+    statistics = {
+        "documents_total": size,
+        "character_count": size * 2500,
+        "document_file_type_counts": [
+            {"mime_type": mime, "mime_type_count": size // len(mime_types)} for mime in mime_types
+        ],
+    }
+    tasks = [
+        {
+            "id": i,
+            "task_id": f"task-{i}",
+            "task_name": "consume_file" if i % 3 else "index_optimize",
+            "status": TASK_STATUSES[i % len(TASK_STATUSES)],
+            "acknowledged": False,
+        }
+        for i in range(size)
+    ]
+    return {"/api/statistics/": json.dumps(statistics).encode(), "/api/tasks/": json.dumps(tasks).encode()}
+
+
+def immich_payloads(size):
+    jobs = {
+        f"queue{i}": {
+            "jobCounts": {
+                "active": i % 3, "completed": 0, "failed": i % 2, "delayed": 0, "waiting": i * 10, "paused": 0
+            },
+            "queueStatus": {"isActive": bool(i % 3), "isPaused": False},
+        }
+        for i in range(size)
+    }
+    statistics = {
+        "photos": size * 100,
+        "videos": size * 10,
+        "usage": size * 10**9,
+        "usageByUser": [{"userId": "bench", "photos": size * 100, "videos": size * 10, "usage": size * 10**9}],
+    }
+    return {"/api/jobs": json.dumps(jobs).encode(), "/api/server/statistics": json.dumps(statistics).encode()}
+
+
+def grafana_payloads(size):
+    groups = []
+    for start in range(0, size, 10):
+        rules = []
+        for i in range(start, min(start + 10, size)):
+            state = RULE_STATES[i % len(RULE_STATES)]
+            rule = {
+                "name": f"Rule {i}",
+                "state": state,
+                "health": "ok",
+                "labels": {"severity": SEVERITIES[i % len(SEVERITIES)], "team": f"team{i % 4}"},
+                "alerts": [],
+            }
+            if state != "inactive":
+                alert_state = "Alerting" if state == "firing" else "Pending"
+                rule["alerts"] = [{"state": alert_state, "activeAt": "2026-01-01T00:00:00Z", "labels": rule["labels"]}]
+            rules.append(rule)
+        groups.append({"name": f"group{start // 10}", "file": f"Folder{start // 100}", "rules": rules})
+    body = {"status": "success", "data": {"groups": groups}}
+    return {"/api/prometheus/grafana/api/v1/rules": json.dumps(body).encode()}
+
+
+def sdm_devices(size):
+    devices = []
+    for i in range(size):
+        devices.append({
+            "name": f"enterprises/bench/devices/thermostat{i}",
+            "type": "sdm.devices.types.THERMOSTAT",
+            "traits": {
+                "sdm.devices.traits.Info": {"customName": ""},
+                "sdm.devices.traits.Temperature": {"ambientTemperatureCelsius": 20 + i % 5},
+                "sdm.devices.traits.Humidity": {"ambientHumidityPercent": 40},
+                "sdm.devices.traits.ThermostatMode": {"mode": "HEAT", "availableModes": ["HEAT", "COOL", "OFF"]},
+                "sdm.devices.traits.ThermostatEco": {"mode": "OFF", "heatCelsius": 15, "coolCelsius": 28},
+                "sdm.devices.traits.ThermostatTemperatureSetpoint": {"heatCelsius": 20},
+                "sdm.devices.traits.ThermostatHvac": {"status": "OFF"},
+                "sdm.devices.traits.Fan": {"timerMode": "OFF"},
+                "sdm.devices.traits.Connectivity": {"status": "ONLINE"},
+            },
+            "parentRelations": [{"parent": "enterprises/bench/structures/s/rooms/r", "displayName": f"Room {i}"}],
+        })
+    return json.dumps({"devices": devices}).encode()
+
+
+class Upstream:
+    """Prebuilt bodies and per-endpoint call counts."""
+
+    def __init__(self, size, latency, jitter):
+        self.size = size
+        self.latency = latency
+        self.jitter = jitter
+        self.bodies = {
+            **glances_payloads(size),
+            **paperless_payloads(size),
+            **immich_payloads(size),
+            **grafana_payloads(size),
+        }
+        self.devices = sdm_devices(size)
+        self.token = json.dumps({"access_token": "bench", "expires_in": 3600, "token_type": "Bearer"}).encode()
+        self.calls = {}
+        self._pages = {}  # (page, page_size) -> documents page body
+        self._lock = threading.Lock()
+
+    def record(self, method, path):
+        key = f"{method} {_ID_SEGMENT.sub('/:id', path)}"
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def take_calls(self, reset):
+        with self._lock:
+            calls = dict(sorted(self.calls.items()))
+            if reset:
+                self.calls = {}
+        return calls
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def documents_page(self, page, page_size):
+        key = (page, page_size)
+        body = self._pages.get(key)
+        if body is None:
+            ids = range((page - 1) * page_size + 1, min(page * page_size, self.size) + 1)
+            body = json.dumps({
+                "count": self.size,
+                "next": f"/api/documents/?page={page + 1}" if page * page_size < self.size else None,
+                "results": [{"id": doc_id, "modified": "2026-01-01T00:00:00Z"} for doc_id in ids],
+            }).encode()
+            self._pages[key] = body
+        return body
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    upstream = None  # set by main()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/_calls":
+            calls = self.upstream.take_calls(reset="reset" in query)
+            return self._send(json.dumps(calls).encode())
+
+        self.upstream.record("GET", url.path)
+        self.upstream.delay()
+        body = self.upstream.bodies.get(url.path)
+        if body is None and url.path == "/api/documents/":
+            page = int(query.get("page", ["1"])[0])
+            body = self.upstream.documents_page(page, int(query.get("page_size", ["25"])[0]))
+        elif body is None and url.path.startswith("/v1/enterprises/") and url.path.endswith("/devices"):
+            body = self.upstream.devices
+        if body is None:
+            return self.send_error(404)
+        self._send(body)
+
+    def do_HEAD(self):
+        path = urllib.parse.urlsplit(self.path).path
+        self.upstream.record("HEAD", path)
+        self.upstream.delay()
+        if not path.startswith("/api/documents/"):
+            return self.send_error(404)
+        self.send_response(200)
+        self.send_header("Content-Length", str(100_000 + len(path)))
+        self.end_headers()
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.upstream.record("POST", path)
+        self.upstream.delay()
+        if path != "/token":
+            return self.send_error(404)
+        self._send(self.upstream.token)
+
+    def _send(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--size", type=int, default=100, help="items in every list payload")
+    args = parser.parse_args()
+
+    StubHandler.upstream = Upstream(args.size, args.latency, args.jitter)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"Upstream stubs on port {args.port}: size {args.size}, latency {args.latency}s + {args.jitter}s", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
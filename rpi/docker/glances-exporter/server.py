@@ -1,23 +1,105 @@
 #!/usr/bin/env python3
-"""Prometheus exporter that scrapes the Glances REST API."""
+"""Prometheus exporter that scrapes one or more Glances REST APIs.
 
-import json
+Targets are configured as name=url pairs (GLANCES_TARGETS) and every series
+carries a `host` label with the target name. /metrics scrapes all targets
+concurrently; /probe?target=<name> scrapes a single one, Blackbox-style, so
+each host can keep its own Prometheus job. Folder sizes are collected only
+for targets listed in FOLDER_TARGETS.
+
+All plugins of a target are collected in roughly one round trip: either
+fetched concurrently (COLLECT_MODE=parallel, the default) or with a single
+call to Glances' /api/4/all endpoint (COLLECT_MODE=bulk).
+
+Optionally (SAMPLE_INTERVAL > 0) a background sampler polls CPU and
+network rates faster than Prometheus scrapes, keeping SAMPLE_WINDOW seconds
+of samples in ring buffers, and exports their min/max/avg/p95 so short
+spikes between scrapes stay visible.
+"""
+
+import math
 import os
-import urllib.request
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import exposition
+import httpclient
+import httpserver
+import selfmetrics
+from ringbuffer import RingBuffer
 
 GLANCES_URL = os.environ.get("GLANCES_URL", "http://localhost:61208")
+# Comma-separated name=url pairs; defaults to a single "local" target at GLANCES_URL
+GLANCES_TARGETS = os.environ.get("GLANCES_TARGETS", f"local={GLANCES_URL}")
+FOLDER_TARGETS = {name.strip() for name in os.environ.get("FOLDER_TARGETS", "").split(",") if name.strip()}
 PORT = int(os.environ.get("PORT", "9101"))
+COLLECT_MODE = os.environ.get("COLLECT_MODE", "parallel")
+SAMPLE_INTERVAL = float(os.environ.get("SAMPLE_INTERVAL", "0"))  # seconds; 0 disables the sampler
+SAMPLE_WINDOW = int(os.environ.get("SAMPLE_WINDOW", "60"))  # seconds of samples summarised per scrape
+
+SAMPLE_PLUGINS = ["cpu", "network"]
+PLUGINS = ["cpu", "mem", "load", "fs", "network", "sensors"]
+SAMPLE_STATS = ("min", "max", "avg", "p95")
+
+# Metric family -> HELP text. Every family is a gauge.
+_HELP = {
+    "glances_up": "Whether the Glances API of the target answered (1) or not (0)",
+    "glances_cpu_percent": "CPU usage percentage",
+    "glances_memory_used_bytes": "Memory used in bytes",
+    "glances_memory_total_bytes": "Total memory in bytes",
+    "glances_memory_percent": "Memory usage percentage",
+    "glances_load_1": "1-minute load average",
+    "glances_load_5": "5-minute load average",
+    "glances_load_15": "15-minute load average",
+    "glances_fs_used_bytes": "Filesystem used bytes",
+    "glances_fs_size_bytes": "Filesystem total size bytes",
+    "glances_fs_percent": "Filesystem usage percentage",
+    "glances_network_rx_bytes_per_sec": "Network bytes received per second",
+    "glances_network_tx_bytes_per_sec": "Network bytes sent per second",
+    "glances_folder_size_bytes": "Directory size in bytes",
+    "glances_temperature_celsius": "Temperature sensor reading",
+    "glances_sample_window_seconds": "Window summarised by the *_sampled metrics",
+}
+for _metric in ("glances_cpu_percent", "glances_network_rx_bytes_per_sec", "glances_network_tx_bytes_per_sec"):
+    _HELP[f"{_metric}_sampled"] = f"{_HELP[_metric]}, sampled every {SAMPLE_INTERVAL:g}s (stat=min|max|avg|p95)"
+FAMILIES = {name: exposition.Family(name, "gauge", help_text) for name, help_text in _HELP.items()}
+
+
+class Target:
+    """One Glances instance to scrape."""
+
+    def __init__(self, name, url, folders):
+        self.name = name
+        self.url = url
+        self.plugins = PLUGINS + (["folders"] if folders else [])
+        self.client = httpclient.Client(url, headers={"Accept": "application/json"}, pool_size=len(self.plugins))
+
+    def fetch_json(self, path):
+        """Fetch JSON from a Glances API endpoint."""
+        return self.client.get_json(f"/api/4/{path}")
+
+
+def _parse_targets(spec):
+    targets = {}
+    for entry in spec.split(","):
+        name, sep, url = entry.strip().partition("=")
+        if not sep or not name or not url:
+            raise ValueError(f"Invalid GLANCES_TARGETS entry {entry!r} (expected name=url)")
+        targets[name] = Target(name, url, name in FOLDER_TARGETS)
+    return targets
+
+
+TARGETS = _parse_targets(GLANCES_TARGETS)
 
+_pool = ThreadPoolExecutor(
+    max_workers=sum(len(target.plugins) for target in TARGETS.values()), thread_name_prefix="glances"
+)
 
-def fetch_json(path):
-    """Fetch JSON from a Glances API endpoint."""
-    req = urllib.request.Request(
-        f"{GLANCES_URL}/api/4/{path}",
-        headers={"Accept": "application/json"},
-    )
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        return json.load(resp)
+# (metric, labels) -> [RingBuffer, monotonic time of last sample]; labels start with ("host", name)
+_samples = {}
+_samples_lock = threading.Lock()
 
 
 def sanitize(label):
@@ -25,124 +107,222 @@ def sanitize(label):
     return label.replace("\\", "").replace('"', "")
 
 
-def build_metrics():
-    """Build Prometheus metrics text from Glances API data."""
-    lines = []
-
-    # CPU
+def _fetch_plugin(target, plugin):
+    """Fetch one plugin, returning (target, plugin, data) with data None on failure."""
     try:
-        cpu = fetch_json("cpu")
-        lines.append("# HELP glances_cpu_percent CPU usage percentage")
-        lines.append("# TYPE glances_cpu_percent gauge")
-        lines.append(f"glances_cpu_percent {cpu.get('total', 0)}")
+        return target, plugin, target.fetch_json(plugin)
     except Exception:
-        pass
+        return target, plugin, None
 
-    # Memory
-    try:
-        mem = fetch_json("mem")
-        lines.append("# HELP glances_memory_used_bytes Memory used in bytes")
-        lines.append("# TYPE glances_memory_used_bytes gauge")
-        lines.append(f"glances_memory_used_bytes {mem.get('used', 0)}")
-        lines.append("# HELP glances_memory_total_bytes Total memory in bytes")
-        lines.append("# TYPE glances_memory_total_bytes gauge")
-        lines.append(f"glances_memory_total_bytes {mem.get('total', 0)}")
-        lines.append("# HELP glances_memory_percent Memory usage percentage")
-        lines.append("# TYPE glances_memory_percent gauge")
-        lines.append(f"glances_memory_percent {mem.get('percent', 0)}")
-    except Exception:
-        pass
 
-    # Load
+def _fetch_all(target, plugins):
+    """Fetch /api/4/all once and trim it to `plugins`."""
     try:
-        load = fetch_json("load")
-        lines.append("# HELP glances_load_1 1-minute load average")
-        lines.append("# TYPE glances_load_1 gauge")
-        lines.append(f"glances_load_1 {load.get('min1', 0)}")
-        lines.append("# HELP glances_load_5 5-minute load average")
-        lines.append("# TYPE glances_load_5 gauge")
-        lines.append(f"glances_load_5 {load.get('min5', 0)}")
-        lines.append("# HELP glances_load_15 15-minute load average")
-        lines.append("# TYPE glances_load_15 gauge")
-        lines.append(f"glances_load_15 {load.get('min15', 0)}")
+        everything = target.fetch_json("all")
     except Exception:
-        pass
+        return [(target, plugin, None) for plugin in plugins]
+    return [(target, plugin, everything.get(plugin)) for plugin in plugins]
 
-    # Filesystem
-    try:
-        fs_list = fetch_json("fs")
-        lines.append("# HELP glances_fs_used_bytes Filesystem used bytes")
-        lines.append("# TYPE glances_fs_used_bytes gauge")
-        lines.append("# HELP glances_fs_size_bytes Filesystem total size bytes")
-        lines.append("# TYPE glances_fs_size_bytes gauge")
-        lines.append("# HELP glances_fs_percent Filesystem usage percentage")
-        lines.append("# TYPE glances_fs_percent gauge")
-        seen = set()
-        for fs in fs_list:
-            mp = sanitize(fs.get("mnt_point", "unknown"))
-            if mp in seen:
-                continue
-            seen.add(mp)
-            lines.append(f'glances_fs_used_bytes{{mountpoint="{mp}"}} {fs.get("used", 0)}')
-            lines.append(f'glances_fs_size_bytes{{mountpoint="{mp}"}} {fs.get("size", 0)}')
-            lines.append(f'glances_fs_percent{{mountpoint="{mp}"}} {fs.get("percent", 0)}')
-    except Exception:
-        pass
 
-    # Network
-    try:
-        net_list = fetch_json("network")
-        lines.append("# HELP glances_network_rx_bytes_per_sec Network bytes received per second")
-        lines.append("# TYPE glances_network_rx_bytes_per_sec gauge")
-        lines.append("# HELP glances_network_tx_bytes_per_sec Network bytes sent per second")
-        lines.append("# TYPE glances_network_tx_bytes_per_sec gauge")
-        for iface in net_list:
-            name = sanitize(iface.get("interface_name", "unknown"))
-            rx = iface.get("bytes_recv_rate_per_sec", 0)
-            tx = iface.get("bytes_sent_rate_per_sec", 0)
-            lines.append(f'glances_network_rx_bytes_per_sec{{interface="{name}"}} {rx}')
-            lines.append(f'glances_network_tx_bytes_per_sec{{interface="{name}"}} {tx}')
-    except Exception:
-        pass
+def collect(targets, plugins=None):
+    """Fetch plugins for all targets concurrently.
 
-    # Temperature sensors
-    try:
-        sensors = fetch_json("sensors")
-        lines.append("# HELP glances_temperature_celsius Temperature sensor reading")
-        lines.append("# TYPE glances_temperature_celsius gauge")
-        for s in sensors:
-            if s.get("type") == "temperature_core":
-                label = sanitize(s.get("label", "unknown"))
-                lines.append(f'glances_temperature_celsius{{label="{label}"}} {s.get("value", 0)}')
-    except Exception:
-        pass
+    Returns {target name: {plugin: data}} with only the plugins that
+    succeeded; `plugins` defaults to each target's full plugin list. In bulk
+    mode /api/4/all returns every enabled plugin, so the payload is trimmed
+    right after decoding.
+    """
+    results = {target.name: {} for target in targets}
+    if COLLECT_MODE == "bulk":
+        fetched = _pool.map(lambda target: _fetch_all(target, plugins or target.plugins), targets)
+        rows = [row for target_rows in fetched for row in target_rows]
+    else:
+        jobs = [(target, plugin) for target in targets for plugin in (plugins or target.plugins)]
+        rows = _pool.map(lambda job: _fetch_plugin(*job), jobs)
+    for target, plugin, data in rows:
+        if data is not None:
+            results[target.name][plugin] = data
+    return results
+
+
+def _cpu_samples(cpu):
+    yield "glances_cpu_percent", (), cpu.get("total", 0)
+
+
+def _mem_samples(mem):
+    yield "glances_memory_used_bytes", (), mem.get("used", 0)
+    yield "glances_memory_total_bytes", (), mem.get("total", 0)
+    yield "glances_memory_percent", (), mem.get("percent", 0)
+
+
+def _load_samples(load):
+    yield "glances_load_1", (), load.get("min1", 0)
+    yield "glances_load_5", (), load.get("min5", 0)
+    yield "glances_load_15", (), load.get("min15", 0)
+
+
+def _fs_samples(fs_list):
+    seen = set()
+    for fs in fs_list:
+        mp = sanitize(fs.get("mnt_point", "unknown"))
+        if mp in seen:
+            continue
+        seen.add(mp)
+        labels = (("mountpoint", mp),)
+        yield "glances_fs_used_bytes", labels, fs.get("used", 0)
+        yield "glances_fs_size_bytes", labels, fs.get("size", 0)
+        yield "glances_fs_percent", labels, fs.get("percent", 0)
+
+
+def _network_samples(net_list):
+    for iface in net_list:
+        labels = (("interface", sanitize(iface.get("interface_name", "unknown"))),)
+        yield "glances_network_rx_bytes_per_sec", labels, iface.get("bytes_recv_rate_per_sec", 0)
+        yield "glances_network_tx_bytes_per_sec", labels, iface.get("bytes_sent_rate_per_sec", 0)
+
+
+def _folder_samples(folders):
+    # Map /rootfs paths back to host paths for cleaner labels
+    for f in folders:
+        path = f.get("path", "unknown")
+        yield "glances_folder_size_bytes", (("path", sanitize(path.replace("/rootfs", ""))),), f.get("size", 0)
+
+
+def _sensor_samples(sensors):
+    for s in sensors:
+        if s.get("type") == "temperature_core":
+            yield "glances_temperature_celsius", (("label", sanitize(s.get("label", "unknown"))),), s.get("value", 0)
+
+
+PLUGIN_SAMPLES = {
+    "cpu": _cpu_samples,
+    "mem": _mem_samples,
+    "load": _load_samples,
+    "fs": _fs_samples,
+    "network": _network_samples,
+    "folders": _folder_samples,
+    "sensors": _sensor_samples,
+}
+
+
+def target_samples(name, plugins):
+    """Return (family, labels, value) samples for one target's plugin data.
+
+    A plugin whose payload is malformed is skipped without affecting the
+    others.
+    """
+    host = (("host", name),)
+    samples = [("glances_up", host, 1 if plugins else 0)]
+    for plugin, data in plugins.items():
+        try:
+            samples.extend((family, host + labels, value) for family, labels, value in PLUGIN_SAMPLES[plugin](data))
+        except Exception:
+            pass
+    return samples
+
+
+def _record(key, value, now, capacity):
+    entry = _samples.get(key)
+    if entry is None:
+        entry = _samples[key] = [RingBuffer(capacity), now]
+    entry[0].append(float(value))
+    entry[1] = now
+
+
+def sample_once():
+    """Take one sample of SAMPLE_PLUGINS for every target into the ring buffers."""
+    capacity = max(1, math.ceil(SAMPLE_WINDOW / SAMPLE_INTERVAL))
+    collected = collect(list(TARGETS.values()), SAMPLE_PLUGINS)
+    now = time.monotonic()
+    with _samples_lock:
+        for name, plugins in collected.items():
+            for family, labels, value in target_samples(name, plugins):
+                if f"{family}_sampled" in FAMILIES:
+                    _record((family, labels), value, now, capacity)
+        # Forget series (e.g. removed interfaces) with no sample in the whole window
+        for key in [key for key, (_, last) in _samples.items() if now - last > SAMPLE_WINDOW]:
+            del _samples[key]
+
+
+def _sampler():
+    """Background loop that calls sample_once() every SAMPLE_INTERVAL seconds."""
+    while True:
+        started = time.monotonic()
+        try:
+            with selfmetrics.timer("sample"):
+                sample_once()
+        except Exception:
+            pass
+        time.sleep(max(0.0, SAMPLE_INTERVAL - (time.monotonic() - started)))
+
+
+def sampled_samples(names):
+    """Return min/max/avg/p95 samples of the sampled series for the named targets."""
+    with _samples_lock:
+        summaries = [
+            (family, labels, buf.summary())
+            for (family, labels), (buf, _) in _samples.items()
+            if len(buf) and labels[0][1] in names
+        ]
+    if not summaries:
+        return []
+    samples = [("glances_sample_window_seconds", (), SAMPLE_WINDOW)]
+    for family, labels, stats in sorted(summaries):
+        for stat, value in zip(SAMPLE_STATS, stats):
+            samples.append((f"{family}_sampled", labels + (("stat", stat),), value))
+    return samples
+
+
+def render(samples, fmt):
+    """Render (family name, labels, value) samples in exposition format `fmt`."""
+    return exposition.render(((FAMILIES[family], labels, value) for family, labels, value in samples), fmt)
+
+
+def build_metrics(targets=None, fmt=exposition.TEXT):
+    """Build the metrics body for `targets` (default: all targets) in `fmt`."""
+    targets = list(TARGETS.values()) if targets is None else targets
+    samples = []
+    for name, plugins in collect(targets).items():
+        samples.extend(target_samples(name, plugins))
+    samples.extend(sampled_samples({target.name for target in targets}))
+    return render(samples, fmt)
 
-    return "\n".join(lines) + "\n"
 
+class MetricsHandler(httpserver.RequestHandler):
+    routes = frozenset({"/health", "/metrics", "/probe"})
 
-class MetricsHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path == "/metrics":
-            try:
-                output = build_metrics()
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(output.encode())
-            except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(f"# error: {e}\n".encode())
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/metrics":
+            self._handle_metrics(None)
+        elif url.path == "/probe":
+            name = urllib.parse.parse_qs(url.query).get("target", [""])[0]
+            if name not in TARGETS:
+                self.send_error(400, f"Unknown target {name!r}; configured: {', '.join(TARGETS)}")
+                return
+            self._handle_metrics([TARGETS[name]])
+        elif url.path == "/health":
+            self.send_health()
         else:
             self.send_error(404)
 
-    def log_message(self, format, *args):
-        pass
+    def _handle_metrics(self, targets):
+        try:
+            # Live readings change every scrape, so there is no version to cache against
+            fmt = self.metrics_format()
+            self.send_metrics(httpserver.Rendered(build_metrics(targets, fmt)), fmt)
+        except Exception as e:
+            self.send_response(500)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(f"# error: {e}\n".encode())
 
 
 if __name__ == "__main__":
-    print(f"Starting glances-exporter on port {PORT}")
-    print(f"Scraping {GLANCES_URL}")
-    server = HTTPServer(("0.0.0.0", PORT), MetricsHandler)
-    server.serve_forever()
+    print(f"Starting glances-exporter on port {PORT} ({COLLECT_MODE} collection)")
+    for target in TARGETS.values():
+        print(f"Target {target.name}: {target.url} ({', '.join(target.plugins)})")
+    if SAMPLE_INTERVAL > 0:
+        print(f"Sampling {', '.join(SAMPLE_PLUGINS)} every {SAMPLE_INTERVAL:g}s over {SAMPLE_WINDOW}s")
+        threading.Thread(target=_sampler, daemon=True).start()
+    httpserver.serve(MetricsHandler, PORT)
@@ -3,81 +3,498 @@
 
 Queries Grafana's Prometheus-compatible rules API and reshapes the response
 into a flat JSON object (for Homepage customapi) and Prometheus metrics.
+Both bodies are rendered once per cached status.
+
+Rule states are kept in an in-memory table. A Grafana webhook contact point
+can POST notifications to /webhook; firing and resolved alerts update the
+table immediately. The rules API remains the source of truth: the table is
+reloaded from it every CACHE_TTL seconds, or every RECONCILE_INTERVAL while
+webhooks keep arriving.
+
+Only rules matching ALERT_STATES, ALERT_FOLDERS and ALERT_MATCHERS are
+tracked. The state filter is passed to Grafana; folders and labels are
+matched while the response is parsed one rule group at a time, so neither
+the whole response nor the rules filtered out are held in memory. The table
+stores one state byte per rule alongside the name and severity columns.
+
+Each new snapshot is diffed against the previous one to keep per-alert
+transition counts, total time firing and the last transition time. They
+are saved to STATE_FILE so the counters survive restarts.
+
+/alerts?severity=critical&state=firing answers from an index over the
+table (severity, folder and every rule label, plus the state column)
+without calling Grafana, even once the table is due for a reload (503
+until / or /metrics has loaded it). Repeated parameters are alternatives, different
+parameters must all match; any other parameter is matched as a label.
+Each alert includes `activeAt`, the time it started pending or firing.
 """
 
+import hmac
 import json
 import os
+import re
+import sys
+import threading
 import time
-import urllib.request
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import urllib.parse
+
+import exposition
+import httpclient
+import httpserver
+import jsonstream
+import selfmetrics
+import singleflight
 
 GRAFANA_URL = os.environ.get("GRAFANA_URL", "http://localhost:3030")
 PORT = int(os.environ.get("PORT", "8080"))
 CACHE_TTL = int(os.environ.get("CACHE_TTL", "30"))
+RECONCILE_INTERVAL = int(os.environ.get("RECONCILE_INTERVAL", "300"))  # full reload while webhooks arrive
+WEBHOOK_TOKEN = os.environ.get("WEBHOOK_TOKEN", "")
+# Comma-separated filters; empty tracks every rule
+ALERT_STATES = [state.strip() for state in os.environ.get("ALERT_STATES", "").split(",") if state.strip()]
+ALERT_FOLDERS = {folder.strip() for folder in os.environ.get("ALERT_FOLDERS", "").split(",") if folder.strip()}
+ALERT_MATCHERS = os.environ.get("ALERT_MATCHERS", "")  # e.g. severity=~critical|warning,team!=media
+STATE_FILE = os.environ.get("STATE_FILE", "/data/alert-stats.json")
+STATE_SAVE_INTERVAL = 60  # seconds between saves while nothing but firing time changed
+RULES_PATH = "/api/prometheus/grafana/api/v1/rules"
 
-_cache = {"data": None, "timestamp": 0}
+# Grafana alert names that stand for the rule given in the "rulename" label
+_SYSTEM_ALERTNAMES = ("DatasourceNoData", "DatasourceError")
+STATE_CODES = {"inactive": 0, "pending": 1, "firing": 2}
+STATE_NAMES = {code: state for state, code in STATE_CODES.items()}
+_MATCHER = re.compile(r"\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*(.*?)\s*$")
 
 
-def _fetch_alerts():
-    """Fetch alert rule states from Grafana."""
-    url = f"{GRAFANA_URL}/api/prometheus/grafana/api/v1/rules"
-    req = urllib.request.Request(url, headers={"Accept": "application/json"})
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        return json.load(resp)
+def _parse_matchers(spec):
+    """Parse "label=value" matchers (=, !=, =~, !~) separated by commas into (label, op, value) tuples."""
+    matchers = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        match = _MATCHER.match(part)
+        if not match:
+            raise ValueError(f"invalid ALERT_MATCHERS entry {part!r}")
+        label, op, value = match.groups()
+        value = value.strip('"')
+        matchers.append((label, op, re.compile(value) if op in ("=~", "!~") else value))
+    return matchers
 
 
-def _get_status():
-    """Get alert counts, using cache if fresh."""
-    now = time.time()
-    if _cache["data"] and (now - _cache["timestamp"]) < CACHE_TTL:
-        return _cache["data"]
+_matchers = _parse_matchers(ALERT_MATCHERS)
+_query = "?" + urllib.parse.urlencode([("state", state) for state in ALERT_STATES]) if ALERT_STATES else ""
+
+
+class AlertTable:
+    """Tracked rules in columns, one row per rule, with one state code byte per row.
+
+    `index` maps label name -> label value -> set of rows; "severity" and
+    "grafana_folder" (the folder title, as on Grafana's alert instances)
+    are always indexed. It is built once by build_index() after loading;
+    webhooks change only the state and activeAt columns.
+    """
+
+    __slots__ = ("names", "severities", "folders", "labels", "states", "active_at", "rows", "index")
+
+    def __init__(self):
+        self.names = []
+        self.severities = []
+        self.folders = []
+        self.labels = []
+        self.states = bytearray()
+        self.active_at = []  # RFC 3339 time the rule became pending/firing, or None
+        self.rows = {}  # rule name -> row
+        self.index = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, severity, state, folder="", labels=None, active_at=None):
+        row = self.rows.get(name)
+        if row is None:
+            row = self.rows[name] = len(self.names)
+            self.names.append(name)
+            self.severities.append(None)
+            self.folders.append(None)
+            self.labels.append(None)
+            self.states.append(state)
+            self.active_at.append(None)
+        self.severities[row] = sys.intern(severity)
+        self.folders[row] = sys.intern(folder)
+        self.labels[row] = labels or {}
+        self.states[row] = state
+        self.active_at[row] = active_at
+
+    def build_index(self):
+        index = {}
+        for row, (labels, severity, folder) in enumerate(zip(self.labels, self.severities, self.folders)):
+            for label, value in {**labels, "severity": severity, "grafana_folder": folder}.items():
+                index.setdefault(label, {}).setdefault(value, set()).add(row)
+        self.index = index
+
+    def query(self, params):
+        """Rows, in rules API order, matching every label in `params` (label name -> accepted values)."""
+        candidates = None
+        for label, values in params.items():
+            by_value = self.index.get(label, {})
+            rows = set().union(*(by_value.get(value, ()) for value in values))
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return []
+        return list(range(len(self.names))) if candidates is None else sorted(candidates)
+
+
+class AlertStats:
+    """Transition and firing-time accounting for one rule."""
+
+    __slots__ = ("state", "transitions", "firing_seconds", "last_transition", "updated")
+
+    def __init__(self, state, transitions=0, firing_seconds=0.0, last_transition=0, updated=None):
+        self.state = state
+        self.transitions = transitions
+        self.firing_seconds = firing_seconds
+        self.last_transition = last_transition
+        self.updated = updated  # time firing_seconds was last brought up to date
 
-    data = _fetch_alerts()
-    groups = data.get("data", {}).get("groups", [])
 
-    firing = 0
-    pending = 0
-    normal = 0
-    firing_names = []
-    per_alert = []
+_cache = {"data": None, "timestamp": 0}  # status snapshot; timestamp is the last reload from Grafana
+_alert_stats = {}  # rule name -> AlertStats
+_last_save = 0
+_table = AlertTable()
+_webhook_updated = {}  # rule name -> time a webhook last set its state
+_last_webhook = 0
+_state_lock = threading.Lock()
+_reload_flight = singleflight.SingleFlight()
+_grafana = httpclient.Client(GRAFANA_URL, headers={"Accept": "application/json"})
+_rendered = httpserver.RenderCache()
+_clock = exposition.SourceClock()  # source timestamps for the status snapshot
+selfmetrics.cache_age("status", lambda: time.time() - _cache["timestamp"] if _cache["data"] else None)
 
-    for group in groups:
+FIRING = exposition.Family("grafana_alerts_firing", "gauge", "Number of currently firing alerts")
+PENDING = exposition.Family("grafana_alerts_pending", "gauge", "Number of pending alerts")
+NORMAL = exposition.Family("grafana_alerts_normal", "gauge", "Number of normal/inactive alerts")
+TOTAL = exposition.Family("grafana_alerts_total", "gauge", "Total number of alert rules")
+ALERT_STATE = exposition.Family("grafana_alert_state", "gauge", "Per-alert state (0=normal, 1=pending, 2=firing)")
+TRANSITIONS = exposition.Family("grafana_alert_transitions_total", "counter", "State changes seen per alert rule")
+FIRING_SECONDS = exposition.Family(
+    "grafana_alert_firing_seconds_total", "counter", "Total seconds each alert rule has been firing"
+)
+LAST_TRANSITION = exposition.Family(
+    "grafana_alert_last_transition_timestamp_seconds", "gauge", "Unix time of the last state change seen per alert rule"
+)
+
+
+def _matches(labels, folder):
+    """Whether a rule (or alert) with these labels in this folder passes the folder and label filters."""
+    if ALERT_FOLDERS and folder not in ALERT_FOLDERS:
+        return False
+    for label, op, value in _matchers:
+        actual = labels.get(label, "")
+        if op == "=":
+            ok = actual == value
+        elif op == "!=":
+            ok = actual != value
+        elif op == "=~":
+            ok = value.fullmatch(actual) is not None
+        else:
+            ok = value.fullmatch(actual) is None
+        if not ok:
+            return False
+    return True
+
+
+def _iter_rule_groups():
+    """Yield the rule groups of the rules API response one at a time.
+
+    Groups are decoded as soon as they are complete, so memory holds one
+    group rather than the whole response.
+    """
+    with _grafana.stream("GET", RULES_PATH + _query) as resp:
+        yield from jsonstream.iter_array(resp, key="groups", source=f"GET {RULES_PATH}")
+
+
+def _active_at(rule):
+    """Earliest activeAt of a rule's alert instances, or None."""
+    times = [alert.get("activeAt") for alert in rule.get("alerts") or []]
+    times = [t for t in times if t and not t.startswith("0001-")]  # Go zero time: never active
+    return min(times) if times else None
+
+
+def _load_table():
+    """Build an AlertTable of the tracked rules from Grafana's rules API."""
+    table = AlertTable()
+    for group in _iter_rule_groups():
+        folder = group.get("file", "")
         for rule in group.get("rules", []):
-            state = rule.get("state", "inactive")
-            name = rule.get("name", "unknown")
-            labels = rule.get("labels", {})
-            severity = labels.get("severity", "unknown")
-            if state == "firing":
-                firing += 1
-                firing_names.append(name)
-                per_alert.append((name, severity, 2))
-            elif state == "pending":
-                pending += 1
-                per_alert.append((name, severity, 1))
-            else:
-                normal += 1
-                per_alert.append((name, severity, 0))
+            labels = rule.get("labels") or {}
+            if not _matches(labels, folder):
+                continue
+            state = STATE_CODES.get(rule.get("state", "inactive"), 0)
+            table.add(
+                rule.get("name", "unknown"),
+                labels.get("severity", "unknown"),
+                state,
+                folder,
+                labels,
+                _active_at(rule) if state else None,
+            )
+    table.build_index()
+    return table
 
-    result = {
+
+def _save_stats(now):
+    """Write the per-alert accounting to STATE_FILE. Caller holds _state_lock."""
+    global _last_save
+    saved = {
+        name: [stats.state, stats.transitions, round(stats.firing_seconds, 3), stats.last_transition]
+        for name, stats in _alert_stats.items()
+    }
+    tmp = f"{STATE_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"saved_at": now, "alerts": saved}, f)
+    os.replace(tmp, STATE_FILE)
+    _last_save = now
+
+
+def load_stats():
+    """Restore per-alert accounting from STATE_FILE; return the number of rules restored.
+
+    Time the proxy was down is not counted as firing.
+    """
+    try:
+        with open(STATE_FILE) as f:
+            saved = json.load(f)["alerts"]
+        restored = {name: AlertStats(int(s), int(t), float(fs), float(lt)) for name, (s, t, fs, lt) in saved.items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return 0
+    with _state_lock:
+        _alert_stats.update(restored)
+    return len(restored)
+
+
+def _advance(stats, state, now):
+    """Bring one rule's accounting up to `now` in `state`; return True if the state changed."""
+    if stats.state == 2 and stats.updated is not None:
+        stats.firing_seconds += max(now - stats.updated, 0)
+    stats.updated = now
+    if stats.state == state:
+        return False
+    stats.state = state
+    stats.transitions += 1
+    stats.last_transition = now
+    return True
+
+
+def _account(now):
+    """Diff the rule table against the last accounted states. Caller holds _state_lock.
+
+    A rule still accounted for but missing from the table dropped out of an
+    ALERT_STATES-filtered response, so it is counted as having gone
+    inactive and kept for when it comes back (unfiltered reloads prune
+    rules that are really gone). Returns True if any rule changed state or
+    started being tracked.
+    """
+    changed = False
+    for name, state in zip(_table.names, _table.states):
+        stats = _alert_stats.get(name)
+        if stats is None:
+            _alert_stats[name] = AlertStats(state, updated=now)
+            changed = True
+        elif _advance(stats, state, now):
+            changed = True
+    for name, stats in _alert_stats.items():
+        if name not in _table.rows and _advance(stats, 0, now):
+            changed = True
+    return changed
+
+
+def _publish(now):
+    """Rebuild the status snapshot from the rule table. Caller holds _state_lock."""
+    changed = _account(now)
+    if changed or now - _last_save >= STATE_SAVE_INTERVAL:
+        try:
+            _save_stats(now)
+        except OSError as e:
+            print(f"Saving {STATE_FILE} failed: {e}", flush=True)
+    accounting = [_alert_stats[name] for name in _table.names]
+    states = bytes(_table.states)
+    firing = states.count(2)
+    pending = states.count(1)
+    _cache["data"] = {
         "firing": firing,
         "pending": pending,
-        "normal": normal,
-        "total": firing + pending + normal,
-        "alerts": firing_names,
-        "per_alert": per_alert,
+        "normal": len(states) - firing - pending,
+        "total": len(states),
+        "names": _table.names,
+        "severities": _table.severities,
+        "states": states,
+        "transitions": [(s.transitions, s.firing_seconds, s.last_transition) for s in accounting],
+        "active_at": list(_table.active_at),
+        "table": _table,
+        "collected_at": now,
+    }
+
+
+def _load_and_publish():
+    """Replace the rule table with Grafana's rules API response.
+
+    Rules a webhook updated after the request was sent keep the webhook's
+    state.
+    """
+    global _table
+    sent = time.time()
+    with selfmetrics.timer("reload"):
+        table = _load_table()
+
+    now = time.time()
+    with _state_lock:
+        for name, updated in _webhook_updated.items():
+            row, old_row = table.rows.get(name), _table.rows.get(name)
+            if updated > sent and row is not None and old_row is not None:
+                table.states[row] = _table.states[old_row]
+        _table = table
+        _webhook_updated.clear()
+        if not ALERT_STATES:  # a filtered response leaves out rules that still exist
+            for name in [name for name in _alert_stats if name not in table.rows]:
+                del _alert_stats[name]
+        _cache["timestamp"] = now
+        _publish(now)
+        return _cache["data"]
+
+
+def _reload():
+    """Reload the rule table, coalescing concurrent callers into one rules API call."""
+    return _reload_flight.run(_load_and_publish)
+
+
+def _get_status():
+    """Get alert counts, reloading from Grafana once the table is due for reconciliation."""
+    ttl = RECONCILE_INTERVAL if time.time() - _last_webhook < RECONCILE_INTERVAL else CACHE_TTL
+    hit = bool(_cache["data"]) and (time.time() - _cache["timestamp"]) < ttl
+    selfmetrics.cache_lookup("status", hit)
+    if hit:
+        return _cache["data"]
+    return _reload()
+
+
+def apply_notification(payload):
+    """Apply a Grafana webhook notification's firing/resolved alerts to the rule table.
+
+    A rule is firing while any of its alert instances in the notification
+    is (Grafana groups notifications by alertname, so one carries all of a
+    rule's instances). Alerts outside the filters are ignored. A tracked
+    rule that is not in the table, or a state ALERT_STATES excludes,
+    schedules a reload on the next request.
+    """
+    global _last_webhook
+    now = time.time()
+    firing = {}  # rule name -> whether any instance in this notification fires
+    starts = {}  # rule name -> earliest startsAt of its firing instances
+    for alert in payload.get("alerts", []):
+        labels = alert.get("labels", {})
+        if not _matches(labels, labels.get("grafana_folder", "")):
+            continue
+        name = labels.get("alertname", "")
+        if name in _SYSTEM_ALERTNAMES:
+            name = labels.get("rulename", name)
+        firing[name] = firing.get(name, False) or alert.get("status") == "firing"
+        if alert.get("status") == "firing" and alert.get("startsAt"):
+            starts[name] = min(starts.get(name, alert["startsAt"]), alert["startsAt"])
+
+    with _state_lock:
+        _last_webhook = now
+        changed = False
+        for name, is_firing in firing.items():
+            state = "firing" if is_firing else "inactive"
+            row = _table.rows.get(name)
+            if row is None or (ALERT_STATES and state not in ALERT_STATES):
+                _cache["timestamp"] = 0
+                continue
+            _webhook_updated[name] = now
+            if _table.states[row] != STATE_CODES[state]:
+                _table.states[row] = STATE_CODES[state]
+                _table.active_at[row] = starts.get(name) if is_firing else None
+                changed = True
+        if changed:
+            _publish(now)
+
+
+def _render_json(status):
+    """Homepage widget body for one status snapshot."""
+    names, severities, states = status["names"], status["severities"], status["states"]
+    result = {
+        "firing": status["firing"],
+        "pending": status["pending"],
+        "normal": status["normal"],
+        "total": status["total"],
+        "alerts": [name for name, state in zip(names, states) if state == 2],
+        "per_alert": [list(row) for row in zip(names, severities, states)],
+        "collected_at": status["collected_at"],
     }
+    return json.dumps(result).encode()
+
+
+def query_alerts(status, query):
+    """Alerts of a status snapshot matching /alerts query parameters (parse_qs form)."""
+    params = {}
+    states = None
+    for key, values in query.items():
+        if key == "state":
+            unknown = [value for value in values if value not in STATE_CODES]
+            if unknown:
+                raise ValueError(f"unknown state {unknown[0]!r} (expected firing, pending or inactive)")
+            states = bytes(STATE_CODES[value] for value in values)
+        else:
+            params["grafana_folder" if key == "folder" else key] = values
+
+    table = status["table"]
+    # Match states against the snapshot, not the live table a webhook may have changed since
+    rows = [row for row in table.query(params) if states is None or status["states"][row] in states]
+    return [
+        {
+            "name": status["names"][row],
+            "state": STATE_NAMES[status["states"][row]],
+            "severity": status["severities"][row],
+            "folder": table.folders[row],
+            "labels": table.labels[row],
+            "activeAt": status["active_at"][row],
+        }
+        for row in rows
+    ]
+
 
-    _cache["data"] = result
-    _cache["timestamp"] = now
-    return result
+def _render_metrics(status, fmt, timestamp):
+    """Metrics body in `fmt` for one status snapshot."""
+    samples = [
+        (FIRING, (), status["firing"]),
+        (PENDING, (), status["pending"]),
+        (NORMAL, (), status["normal"]),
+        (TOTAL, (), status["total"]),
+    ]
+    rows = list(zip(status["names"], status["severities"], status["states"], status["transitions"]))
+    for name, severity, value, _ in rows:
+        samples.append((ALERT_STATE, (("alertname", name), ("severity", severity)), value))
+    for name, severity, _, (transitions, firing_seconds, last_transition) in rows:
+        labels = (("alertname", name), ("severity", severity))
+        samples.append((TRANSITIONS, labels, transitions))
+        samples.append((FIRING_SECONDS, labels, round(firing_seconds, 3)))
+        if last_transition:
+            samples.append((LAST_TRANSITION, labels, last_transition))
+    return exposition.render(samples, fmt, timestamp=timestamp)
 
 
-class AlertHandler(BaseHTTPRequestHandler):
+class AlertHandler(httpserver.RequestHandler):
+    routes = frozenset({"/", "/health", "/metrics", "/alerts", "/webhook"})
+
     def do_GET(self):
-        if self.path == "/":
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/":
             self._handle_json()
-        elif self.path == "/metrics":
+        elif url.path == "/metrics":
             self._handle_metrics()
+        elif url.path == "/alerts":
+            self._handle_alerts(urllib.parse.parse_qs(url.query))
+        elif url.path == "/health":
+            self.send_health()
         else:
             self.send_error(404)
 
@@ -85,60 +502,78 @@ class AlertHandler(BaseHTTPRequestHandler):
         """JSON endpoint for Homepage widget."""
         try:
             status = _get_status()
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(status).encode())
+            rendered = _rendered.get("json", status, lambda: _render_json(status))
+            self.send_rendered(rendered, httpserver.JSON_CONTENT_TYPE)
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
 
+    def _handle_alerts(self, query):
+        """Indexed alert query: /alerts?severity=critical&state=firing&folder=Homelab&<label>=<value>."""
+        # Answer from the current table, never reloading it: / and /metrics keep it reconciled
+        status = _cache["data"]
+        if not status:
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "no alert status loaded yet"}).encode())
+            return
+        try:
+            alerts = query_alerts(status, query)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps({"alerts": alerts, "count": len(alerts), "collected_at": status["collected_at"]}).encode()
+        self.send_rendered(httpserver.Rendered(body), httpserver.JSON_CONTENT_TYPE)
+
     def _handle_metrics(self):
         """Prometheus metrics endpoint."""
         try:
             status = _get_status()
-            lines = [
-                "# HELP grafana_alerts_firing Number of currently firing alerts",
-                "# TYPE grafana_alerts_firing gauge",
-                f"grafana_alerts_firing {status['firing']}",
-                "# HELP grafana_alerts_pending Number of pending alerts",
-                "# TYPE grafana_alerts_pending gauge",
-                f"grafana_alerts_pending {status['pending']}",
-                "# HELP grafana_alerts_normal Number of normal/inactive alerts",
-                "# TYPE grafana_alerts_normal gauge",
-                f"grafana_alerts_normal {status['normal']}",
-                "# HELP grafana_alerts_total Total number of alert rules",
-                "# TYPE grafana_alerts_total gauge",
-                f"grafana_alerts_total {status['total']}",
-                "# HELP grafana_alert_state Per-alert state (0=normal, 1=pending, 2=firing)",
-                "# TYPE grafana_alert_state gauge",
-            ]
-            for name, severity, value in status.get("per_alert", []):
-                safe_name = name.replace('"', '\\"')
-                safe_sev = severity.replace('"', '\\"')
-                lines.append(
-                    f'grafana_alert_state{{alertname="{safe_name}",severity="{safe_sev}"}} {value}'
-                )
-            output = "\n".join(lines) + "\n"
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(output.encode())
+            fmt = self.metrics_format()
+            timestamp = _clock.timestamp(status["collected_at"])
+            rendered = _rendered.get(
+                ("metrics", fmt.name), (status, timestamp), lambda: _render_metrics(status, fmt, timestamp)
+            )
+            self.send_metrics(rendered, fmt)
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "text/plain")
             self.end_headers()
             self.wfile.write(f"# error: {e}\n".encode())
 
-    def log_message(self, format, *args):
-        pass
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/webhook":
+            self.send_error(404)
+            return
+        token = urllib.parse.parse_qs(url.query).get("token", [""])[0]
+        if WEBHOOK_TOKEN and not hmac.compare_digest(token, WEBHOOK_TOKEN):
+            self.send_error(403)
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(payload, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            self.send_error(400, f"Not a Grafana webhook notification: {e}")
+            return
+        apply_notification(payload)
+        self.send_response(204)
+        self.end_headers()
 
 
 if __name__ == "__main__":
     print(f"Starting Grafana alerts proxy on port {PORT}")
     print(f"Querying {GRAFANA_URL}")
-    print(f"Cache TTL: {CACHE_TTL}s")
-    server = HTTPServer(("0.0.0.0", PORT), AlertHandler)
-    server.serve_forever()
+    print(f"Cache TTL: {CACHE_TTL}s ({RECONCILE_INTERVAL}s while notifications arrive on /webhook)")
+    print(f"Restored accounting for {load_stats()} alert rules from {STATE_FILE}")
+    if not WEBHOOK_TOKEN:
+        print("WARNING: WEBHOOK_TOKEN is not set; /webhook accepts unauthenticated notifications")
+    if ALERT_STATES or ALERT_FOLDERS or _matchers:
+        folders = sorted(ALERT_FOLDERS) or "all"
+        print(f"Tracking states {ALERT_STATES or 'all'}, folders {folders}, matchers {ALERT_MATCHERS!r}")
+    httpserver.serve(AlertHandler, PORT)
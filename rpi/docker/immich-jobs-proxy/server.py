@@ -1,76 +1,275 @@
 #!/usr/bin/env python3
-"""Simple proxy that aggregates Immich job queue counts."""
+"""Simple proxy that aggregates Immich job queue counts.
+
+Each upstream call is cached on its own schedule. Job counts are cheap and
+refetched on demand once older than JOBS_TTL seconds; concurrent requests
+that find them expired wait for a single upstream refresh. Server
+statistics make Immich aggregate every library, so a background thread
+refreshes them every STATS_INTERVAL seconds and requests never wait on
+them. / and /metrics share the cached data, and /metrics reports the age
+of each source.
+
+Every job-count fetch is also recorded per queue in ring buffers covering
+DRAIN_WINDOW seconds. The queue's drain rate (least-squares slope of its
+waiting + active backlog over the window) and estimated time to empty are
+recomputed once per fetch, so scrapes only read them.
+"""
 
 import json
+import math
 import os
-import urllib.request
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+
+import exposition
+import httpclient
+import httpserver
+import selfmetrics
+import singleflight
+from ringbuffer import RingBuffer
 
 IMMICH_URL = os.environ.get("IMMICH_URL", "http://localhost:2283")
 IMMICH_API_KEY = os.environ.get("IMMICH_API_KEY", "")
 IMMICH_STATS_API_KEY = os.environ.get("IMMICH_STATS_API_KEY", "")
 PORT = int(os.environ.get("PORT", "8080"))
+JOBS_TTL = float(os.environ.get("JOBS_TTL", "10"))  # seconds job counts are served before refetching
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", "600"))  # seconds between statistics refreshes
+REFRESH_RETRY = 30  # seconds between attempts after a failed statistics refresh
+DRAIN_WINDOW = float(os.environ.get("DRAIN_WINDOW", "600"))  # seconds of backlog history per queue
+DRAIN_SAMPLES = int(DRAIN_WINDOW / max(JOBS_TTL, 1)) + 1  # ring buffer capacity: one sample per fetch
+
+_cache = {
+    "jobs": {"data": None, "timestamp": 0},
+    "stats": {"data": None, "timestamp": 0},
+}
+_jobs_refresh = singleflight.SingleFlight()
+_history = {}  # queue -> (RingBuffer of monotonic times, RingBuffer of backlogs)
+_drain = {}  # queue -> (drain rate in jobs/s, seconds to empty or None); replaced on every fetch
+_immich = httpclient.Client(IMMICH_URL, headers={"Accept": "application/json"})
+_rendered = httpserver.RenderCache()  # bodies are reused while the cached responses are unchanged
+selfmetrics.cache_age("jobs", lambda: _source_age("jobs"))
+selfmetrics.cache_age("stats", lambda: _source_age("stats"))
+
+JOBS_ACTIVE = exposition.Family("immich_jobs_active", "gauge", "Number of active jobs")
+JOBS_WAITING = exposition.Family("immich_jobs_waiting", "gauge", "Number of waiting jobs")
+JOBS_FAILED = exposition.Family("immich_jobs_failed", "gauge", "Number of failed jobs")
+JOBS_DELAYED = exposition.Family("immich_jobs_delayed", "gauge", "Number of delayed jobs")
+JOBS_PAUSED = exposition.Family("immich_jobs_paused", "gauge", "Whether the queue is paused")
+JOBS_ACTIVE_TOTAL = exposition.Family("immich_jobs_active_total", "gauge", "Total active jobs across all queues")
+JOBS_WAITING_TOTAL = exposition.Family("immich_jobs_waiting_total", "gauge", "Total waiting jobs across all queues")
+JOBS_FAILED_TOTAL = exposition.Family("immich_jobs_failed_total", "gauge", "Total failed jobs across all queues")
+PHOTOS = exposition.Family("immich_photos_total", "gauge", "Total number of photos")
+VIDEOS = exposition.Family("immich_videos_total", "gauge", "Total number of videos")
+STORAGE = exposition.Family("immich_storage_bytes", "gauge", "Total storage used in bytes")
+DRAIN_RATE = exposition.Family(
+    "immich_jobs_drain_rate", "gauge", "Jobs drained per second over the drain window (negative while growing)"
+)
+DRAIN_ETA = exposition.Family(
+    "immich_jobs_eta_seconds", "gauge", "Estimated seconds until the queue is empty at the current drain rate"
+)
+SOURCE_AGE = exposition.Family(
+    "immich_source_age_seconds", "gauge", "Seconds since the cached response of each upstream source was fetched"
+)
+
+
+def _source_age(source):
+    """Seconds since `source` was last fetched, or None if it never was."""
+    timestamp = _cache[source]["timestamp"]
+    return time.time() - timestamp if timestamp else None
+
+
+def _fetch_jobs():
+    """Fetch job data from Immich API."""
+    return _immich.get_json("/api/jobs", headers={"x-api-key": IMMICH_API_KEY})
+
+
+def _fetch_server_stats():
+    """Fetch server statistics from Immich API."""
+    key = IMMICH_STATS_API_KEY or IMMICH_API_KEY
+    return _immich.get_json("/api/server/statistics", headers={"x-api-key": key})
+
+
+def _drain_rate(times, backlogs):
+    """Least-squares drain rate (jobs/s) of backlog samples, or None without enough history."""
+    n = len(times)
+    if n < 2 or times[-1] - times[0] < JOBS_TTL:
+        return None
+    mean_t = math.fsum(times) / n
+    mean_b = math.fsum(backlogs) / n
+    var_t = math.fsum((t - mean_t) ** 2 for t in times)
+    cov = math.fsum((t - mean_t) * (b - mean_b) for t, b in zip(times, backlogs))
+    return -cov / var_t if cov else 0.0
+
+
+def _record_backlogs(data, now):
+    """Append one backlog sample per queue and recompute its drain rate and ETA."""
+    global _drain
+    drain = {}
+    for queue, info in data.items():
+        counts = info.get("jobCounts", {})
+        backlog = counts.get("waiting", 0) + counts.get("active", 0)
+        history = _history.get(queue)
+        if history is None:
+            history = _history[queue] = (RingBuffer(DRAIN_SAMPLES), RingBuffer(DRAIN_SAMPLES))
+        history[0].append(now)
+        history[1].append(backlog)
+
+        times, backlogs = history[0].values(), history[1].values()
+        start = next(i for i, t in enumerate(times) if now - t <= DRAIN_WINDOW)
+        rate = _drain_rate(times[start:], backlogs[start:])
+        if rate is None:
+            continue
+        if not backlog:
+            eta = 0
+        elif rate > 0:
+            eta = backlog / rate
+        else:
+            eta = None
+        drain[queue] = (rate, eta)
+    _drain = drain
+
+
+def _store_jobs():
+    data = _fetch_jobs()
+    _record_backlogs(data, time.monotonic())
+    _cache["jobs"]["data"] = data
+    _cache["jobs"]["timestamp"] = time.time()
+    return data
+
+
+def _refresh_jobs():
+    """Refetch job counts, coalescing concurrent callers into one upstream call."""
+    return _jobs_refresh.run(_store_jobs)
+
+
+def _get_jobs():
+    """Return the cached job counts, refetching them once older than JOBS_TTL."""
+    entry = _cache["jobs"]
+    hit = entry["data"] is not None and time.time() - entry["timestamp"] < JOBS_TTL
+    selfmetrics.cache_lookup("jobs", hit)
+    if hit:
+        return entry["data"]
+    return _refresh_jobs()
 
 
-class JobsHandler(BaseHTTPRequestHandler):
-    def _fetch_jobs(self):
-        """Fetch job data from Immich API."""
-        req = urllib.request.Request(
-            f"{IMMICH_URL}/api/jobs",
-            headers={"x-api-key": IMMICH_API_KEY, "Accept": "application/json"},
-        )
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return json.load(resp)
-
-    def _fetch_server_stats(self):
-        """Fetch server statistics from Immich API."""
-        key = IMMICH_STATS_API_KEY or IMMICH_API_KEY
-        req = urllib.request.Request(
-            f"{IMMICH_URL}/api/server/statistics",
-            headers={"x-api-key": key, "Accept": "application/json"},
-        )
+def _stats_refresher():
+    """Background loop that refreshes server statistics every STATS_INTERVAL seconds."""
+    entry = _cache["stats"]
+    while True:
         try:
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                return json.load(resp)
-        except Exception:
-            return None
+            entry["data"] = _fetch_server_stats()
+            entry["timestamp"] = time.time()
+        except Exception as e:
+            print(f"Statistics refresh failed: {e}", flush=True)
+            time.sleep(REFRESH_RETRY)
+            continue
+        time.sleep(STATS_INTERVAL)
+
+
+def _render_source_ages(fmt):
+    """Per-source age gauges, rendered per request (sources never fetched are omitted)."""
+    now = time.time()
+    samples = [
+        (SOURCE_AGE, (("source", source),), round(now - entry["timestamp"], 1))
+        for source, entry in _cache.items()
+        if entry["timestamp"]
+    ]
+    return exposition.render(samples, fmt)
+
+
+def _render_json(data):
+    """Homepage widget body (aggregated totals)."""
+    total_active = 0
+    total_waiting = 0
+    total_failed = 0
+    job_types = 0
+
+    for job_type, info in data.items():
+        counts = info.get("jobCounts", {})
+        total_active += counts.get("active", 0)
+        total_waiting += counts.get("waiting", 0)
+        total_failed += counts.get("failed", 0)
+        job_types += 1
+
+    result = {
+        "active": total_active,
+        "waiting": total_waiting,
+        "failed": total_failed,
+        "queues": job_types,
+    }
+    return json.dumps(result).encode()
+
+
+def _render_metrics(data, stats, drain, fmt):
+    """Metrics body in `fmt` with per-queue breakdowns, drain rates and server statistics."""
+    samples = []
+    total_active = 0
+    total_waiting = 0
+    total_failed = 0
+
+    for queue, info in data.items():
+        counts = info.get("jobCounts", {})
+        active = counts.get("active", 0)
+        waiting = counts.get("waiting", 0)
+        failed = counts.get("failed", 0)
+        labels = (("queue", queue),)
+
+        samples.append((JOBS_ACTIVE, labels, active))
+        samples.append((JOBS_WAITING, labels, waiting))
+        samples.append((JOBS_FAILED, labels, failed))
+        samples.append((JOBS_DELAYED, labels, counts.get("delayed", 0)))
+        samples.append((JOBS_PAUSED, labels, 1 if counts.get("paused", 0) else 0))
+
+        total_active += active
+        total_waiting += waiting
+        total_failed += failed
+
+    for queue, (rate, eta) in drain.items():
+        labels = (("queue", queue),)
+        samples.append((DRAIN_RATE, labels, round(rate, 4)))
+        if eta is not None:
+            samples.append((DRAIN_ETA, labels, round(eta)))
+
+    samples.append((JOBS_ACTIVE_TOTAL, (), total_active))
+    samples.append((JOBS_WAITING_TOTAL, (), total_waiting))
+    samples.append((JOBS_FAILED_TOTAL, (), total_failed))
+
+    # Server statistics (photos, videos, storage)
+    if stats:
+        photos = 0
+        videos = 0
+        usage_bytes = 0
+        for user_stat in stats.get("usageByUser", []):
+            photos += user_stat.get("photos", 0)
+            videos += user_stat.get("videos", 0)
+            usage_bytes += user_stat.get("usage", 0)
+
+        samples.append((PHOTOS, (), photos))
+        samples.append((VIDEOS, (), videos))
+        samples.append((STORAGE, (), usage_bytes))
+
+    return exposition.render(samples, fmt)
+
+
+class JobsHandler(httpserver.RequestHandler):
+    routes = frozenset({"/", "/health", "/metrics"})
 
     def do_GET(self):
         if self.path == "/":
             self._handle_json()
         elif self.path == "/metrics":
             self._handle_metrics()
+        elif self.path == "/health":
+            self.send_health()
         else:
             self.send_error(404)
 
     def _handle_json(self):
         """JSON endpoint for Homepage widget (aggregated totals)."""
         try:
-            data = self._fetch_jobs()
-
-            total_active = 0
-            total_waiting = 0
-            total_failed = 0
-            job_types = 0
-
-            for job_type, info in data.items():
-                counts = info.get("jobCounts", {})
-                total_active += counts.get("active", 0)
-                total_waiting += counts.get("waiting", 0)
-                total_failed += counts.get("failed", 0)
-                job_types += 1
-
-            result = {
-                "active": total_active,
-                "waiting": total_waiting,
-                "failed": total_failed,
-                "queues": job_types,
-            }
-
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
+            data = _get_jobs()
+            rendered = _rendered.get("json", data, lambda: _render_json(data))
+            self.send_rendered(rendered, httpserver.JSON_CONTENT_TYPE)
 
         except Exception as e:
             self.send_response(500)
@@ -81,78 +280,16 @@ class JobsHandler(BaseHTTPRequestHandler):
     def _handle_metrics(self):
         """Prometheus metrics endpoint with per-queue breakdowns."""
         try:
-            data = self._fetch_jobs()
-
-            lines = []
-            lines.append("# HELP immich_jobs_active Number of active jobs")
-            lines.append("# TYPE immich_jobs_active gauge")
-            lines.append("# HELP immich_jobs_waiting Number of waiting jobs")
-            lines.append("# TYPE immich_jobs_waiting gauge")
-            lines.append("# HELP immich_jobs_failed Number of failed jobs")
-            lines.append("# TYPE immich_jobs_failed gauge")
-            lines.append("# HELP immich_jobs_delayed Number of delayed jobs")
-            lines.append("# TYPE immich_jobs_delayed gauge")
-            lines.append("# HELP immich_jobs_paused Whether the queue is paused")
-            lines.append("# TYPE immich_jobs_paused gauge")
-
-            total_active = 0
-            total_waiting = 0
-            total_failed = 0
-
-            for queue, info in data.items():
-                counts = info.get("jobCounts", {})
-                active = counts.get("active", 0)
-                waiting = counts.get("waiting", 0)
-                failed = counts.get("failed", 0)
-                delayed = counts.get("delayed", 0)
-                paused = 1 if counts.get("paused", 0) else 0
-
-                lines.append(f'immich_jobs_active{{queue="{queue}"}} {active}')
-                lines.append(f'immich_jobs_waiting{{queue="{queue}"}} {waiting}')
-                lines.append(f'immich_jobs_failed{{queue="{queue}"}} {failed}')
-                lines.append(f'immich_jobs_delayed{{queue="{queue}"}} {delayed}')
-                lines.append(f'immich_jobs_paused{{queue="{queue}"}} {paused}')
-
-                total_active += active
-                total_waiting += waiting
-                total_failed += failed
-
-            lines.append("# HELP immich_jobs_active_total Total active jobs across all queues")
-            lines.append("# TYPE immich_jobs_active_total gauge")
-            lines.append(f"immich_jobs_active_total {total_active}")
-            lines.append("# HELP immich_jobs_waiting_total Total waiting jobs across all queues")
-            lines.append("# TYPE immich_jobs_waiting_total gauge")
-            lines.append(f"immich_jobs_waiting_total {total_waiting}")
-            lines.append("# HELP immich_jobs_failed_total Total failed jobs across all queues")
-            lines.append("# TYPE immich_jobs_failed_total gauge")
-            lines.append(f"immich_jobs_failed_total {total_failed}")
-
-            # Server statistics (photos, videos, storage)
-            stats = self._fetch_server_stats()
-            if stats:
-                photos = 0
-                videos = 0
-                usage_bytes = 0
-                for user_stat in stats.get("usageByUser", []):
-                    photos += user_stat.get("photos", 0)
-                    videos += user_stat.get("videos", 0)
-                    usage_bytes += user_stat.get("usage", 0)
-
-                lines.append("# HELP immich_photos_total Total number of photos")
-                lines.append("# TYPE immich_photos_total gauge")
-                lines.append(f"immich_photos_total {photos}")
-                lines.append("# HELP immich_videos_total Total number of videos")
-                lines.append("# TYPE immich_videos_total gauge")
-                lines.append(f"immich_videos_total {videos}")
-                lines.append("# HELP immich_storage_bytes Total storage used in bytes")
-                lines.append("# TYPE immich_storage_bytes gauge")
-                lines.append(f"immich_storage_bytes {usage_bytes}")
-
-            output = "\n".join(lines) + "\n"
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(output.encode())
+            data = _get_jobs()
+            stats = _cache["stats"]["data"]
+            drain = _drain
+            fmt = self.metrics_format()
+            rendered = _rendered.get(
+                ("metrics", fmt.name),
+                (data, stats, drain),
+                lambda: _render_metrics(data, stats, drain, fmt),
+            )
+            self.send_metrics(rendered, fmt, _render_source_ages(fmt))
 
         except Exception as e:
             self.send_response(500)
@@ -160,12 +297,10 @@ class JobsHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(f"# error: {e}\n".encode())
 
-    def log_message(self, format, *args):
-        pass  # Suppress logging
-
 
 if __name__ == "__main__":
     print(f"Starting Immich jobs proxy on port {PORT}")
     print(f"Proxying to {IMMICH_URL}")
-    server = HTTPServer(("0.0.0.0", PORT), JobsHandler)
-    server.serve_forever()
+    print(f"Job counts cached for {JOBS_TTL}s, statistics refreshed every {STATS_INTERVAL}s")
+    threading.Thread(target=_stats_refresher, daemon=True).start()
+    httpserver.serve(JobsHandler, PORT)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Post recorded SDM events to nest-exporter's /events endpoint.
+
+Stands in for the Pub/Sub push subscription when testing locally: each line
+of the events file is one SDM event (the decoded `message.data` of a push),
+which is wrapped in a Pub/Sub push envelope and POSTed in order.
+
+    python replay_events.py sample-events.jsonl --url http://localhost:9102/events --token "$EVENTS_TOKEN"
+
+Events are sent with their recorded `timestamp` unless --now is given, which
+restamps them with the current time (recorded timestamps older than the
+exporter's last poll are ignored as out of date). The sample events name
+thermostat0 of the benchmark stubs (rpi/docker/bench/stubs.py); --device
+rewrites them to another device, e.g. a real thermostat's resource name.
+
+--check reads /metrics after every HVAC event and fails unless
+nest_hvac_status of the device changed to the event's status, which
+exercises the trait-patching path end to end:
+
+    python replay_events.py sample-events.jsonl --now --check --delay 0
+"""
+
+import argparse
+import base64
+import json
+import re
+import sys
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+
+def push_envelope(event, message_id):
+    """Wrap one SDM event the way a Pub/Sub push subscription delivers it."""
+    return {
+        "message": {
+            "data": base64.b64encode(json.dumps(event).encode()).decode(),
+            "messageId": str(message_id),
+            "publishTime": event.get("timestamp", ""),
+        },
+        "subscription": "projects/local/subscriptions/nest-exporter-replay",
+    }
+
+
+HVAC_STATUS = {"OFF": 0, "HEATING": 1, "COOLING": 2}  # nest_hvac_status values
+
+
+def hvac_status(metrics_url, device_id):
+    """Current nest_hvac_status of `device_id` from /metrics, or None if it is not exported."""
+    with urllib.request.urlopen(metrics_url, timeout=10) as resp:
+        body = resp.read().decode()
+    pattern = rf'^nest_hvac_status{{device_id="{re.escape(device_id)}"[^}}]*}} (\S+)'
+    match = re.search(pattern, body, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def set_device(event, device):
+    """Point an event's resource update (and resource group) at `device`."""
+    if "resourceUpdate" in event:
+        event["resourceUpdate"]["name"] = device
+    if "resourceGroup" in event:
+        event["resourceGroup"] = [device]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("events", help="JSON-lines file of recorded SDM events")
+    parser.add_argument("--url", default="http://localhost:9102/events")
+    parser.add_argument("--token", default="", help="EVENTS_TOKEN configured on the exporter")
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds between events")
+    parser.add_argument("--now", action="store_true", help="restamp events with the current time")
+    parser.add_argument("--device", help="resource name to send the events for (enterprises/<project>/devices/<id>)")
+    parser.add_argument("--check", action="store_true", help="verify nest_hvac_status follows each HVAC event")
+    parser.add_argument("--metrics-url", help="exporter /metrics for --check (default: next to --url)")
+    args = parser.parse_args()
+    metrics_url = args.metrics_url or urllib.parse.urljoin(args.url, "/metrics")
+
+    url = args.url
+    if args.token:
+        url += ("&" if "?" in url else "?") + urllib.parse.urlencode({"token": args.token})
+
+    with open(args.events) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+
+    failures = 0
+    for i, event in enumerate(events, 1):
+        if args.device:
+            set_device(event, args.device)
+        if args.now:
+            event["timestamp"] = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        body = json.dumps(push_envelope(event, i)).encode()
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            print(f"{i}/{len(events)} {event.get('eventId', '?')}: HTTP {resp.status}")
+
+        hvac = event.get("resourceUpdate", {}).get("traits", {}).get("sdm.devices.traits.ThermostatHvac")
+        if args.check and hvac:
+            device_id = event["resourceUpdate"]["name"].split("/")[-1]
+            expected = HVAC_STATUS.get(hvac.get("status"), 0)
+            actual = hvac_status(metrics_url, device_id)
+            if actual != expected:
+                failures += 1
+                print(f"  FAIL: nest_hvac_status{{device_id={device_id!r}}} is {actual}, expected {expected}")
+            else:
+                print(f"  ok: nest_hvac_status{{device_id={device_id!r}}} = {expected}")
+        time.sleep(args.delay)
+
+    if failures:
+        sys.exit(f"{failures} HVAC check(s) failed (events older than the last poll are ignored; try --now)")
+
+
+if __name__ == "__main__":
+    main()
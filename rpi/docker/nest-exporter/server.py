@@ -1,16 +1,62 @@
 #!/usr/bin/env python3
-"""Prometheus exporter for Google Nest thermostat via the Smart Device Management API."""
-
+"""Prometheus exporter for Google Nest thermostats via the Smart Device Management API.
+
+One devices.list call per poll covers every thermostat in the project. Each
+series carries `device_id` and `room` labels, and the FIELDS descriptor
+table drives both the metrics and the JSON summary.
+
+SDM events delivered by a Pub/Sub push subscription to POST /events patch
+the cached device traits as they happen. While thermostat events keep
+arriving, polling drops to a slow reconciliation every RECONCILE_INTERVAL
+seconds.
+Without them the poll rate follows the thermostats: ACTIVE_POLL_INTERVAL
+while any is heating/cooling or a setpoint/mode changed recently,
+POLL_INTERVAL when idle, OFFLINE_POLL_INTERVAL when all are offline. SDM
+calls are kept within POLL_BUDGET_PER_DAY (rolling 24h, paced so the
+budget is never exhausted) and POLL_BUDGET_PER_MINUTE.
+
+Polling runs in a background thread that backs off exponentially (with
+jitter) while the SDM API is failing. Requests never call Google: they are
+answered from the last good snapshot, waiting at most REQUEST_WAIT seconds
+for the first poll after startup.
+
+The OAuth access token is refreshed by another background thread
+TOKEN_REFRESH_AHEAD seconds before it expires and saved to TOKEN_FILE
+(mode 0600), so a restarted exporter reuses it instead of calling Google.
+"""
+
+import base64
+import collections
+import hmac
 import json
 import os
+import random
+import threading
 import time
-import urllib.request
 import urllib.parse
 from datetime import datetime, timezone
-from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import exposition
+import httpclient
+import httpserver
+import selfmetrics
 
 PORT = int(os.environ.get("PORT", "9102"))
-POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", "60"))
+POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", "300"))  # idle: online, not heating or cooling
+ACTIVE_POLL_INTERVAL = int(os.environ.get("ACTIVE_POLL_INTERVAL", "30"))  # heating/cooling or just changed
+OFFLINE_POLL_INTERVAL = int(os.environ.get("OFFLINE_POLL_INTERVAL", "900"))  # every thermostat offline
+ACTIVE_HOLD = 600  # seconds a setpoint/mode change keeps the active interval
+POLL_BUDGET_PER_DAY = int(os.environ.get("POLL_BUDGET_PER_DAY", "2000"))  # SDM calls per rolling 24h
+POLL_BUDGET_PER_MINUTE = int(os.environ.get("POLL_BUDGET_PER_MINUTE", "5"))
+RECONCILE_INTERVAL = int(os.environ.get("RECONCILE_INTERVAL", "900"))  # poll interval while events arrive
+POLL_RETRY = 5  # seconds before the first retry after a failed poll; doubles per failure
+POLL_BACKOFF_MAX = int(os.environ.get("POLL_BACKOFF_MAX", "900"))
+REQUEST_WAIT = float(os.environ.get("REQUEST_WAIT", "2"))  # max seconds a request waits for the first poll
+TOKEN_FILE = os.environ.get("TOKEN_FILE", "/data/token.json")
+TOKEN_REFRESH_AHEAD = int(os.environ.get("TOKEN_REFRESH_AHEAD", "600"))  # refresh this long before expiry
+TOKEN_MIN_VALIDITY = 60  # a token closer than this to expiry is not used
+# Shared secret expected as ?token= on POST /events (set it in the Pub/Sub push endpoint URL)
+EVENTS_TOKEN = os.environ.get("EVENTS_TOKEN", "")
 
 # Google OAuth2 / SDM API credentials
 SDM_PROJECT_ID = os.environ.get("SDM_PROJECT_ID", "")
@@ -18,18 +64,132 @@ GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", "")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET", "")
 GOOGLE_REFRESH_TOKEN = os.environ.get("GOOGLE_REFRESH_TOKEN", "")
 
-SDM_API_BASE = "https://smartdevicemanagement.googleapis.com/v1"
-TOKEN_URL = "https://oauth2.googleapis.com/token"
+# Overridable so the exporter can run against local stubs (rpi/docker/bench)
+SDM_API_BASE = os.environ.get("SDM_API_BASE", "https://smartdevicemanagement.googleapis.com/v1")
+TOKEN_URL = os.environ.get("TOKEN_URL", "https://oauth2.googleapis.com/token")
+
+_oauth = httpclient.Client(TOKEN_URL)
+_sdm = httpclient.Client(SDM_API_BASE, timeout=15)
 
 # Cached state
 _access_token = None
 _token_expiry = 0
+_devices = {}  # device name -> raw SDM thermostat resource, patched by events
+_parsed = {}  # device name -> parse_thermostat() result
+_known_devices = set()  # every device name in the last poll, thermostat or not
+_trait_updated = {}  # (device name, trait) -> time the cached trait value is from
 _cached_data = {}
-_last_poll = 0
+_last_poll = 0  # time of the last successful poll
+_last_event = 0
+_events_total = 0
+_poll_errors_total = 0
+_last_change = 0  # time of the last setpoint/mode change seen
+_sdm_calls = collections.deque()  # times of SDM API calls in the last 24h
+_poll_interval_current = 0
+_state_lock = threading.Lock()
+_token_lock = threading.Lock()  # one token refresh at a time
+_poll_now = threading.Event()  # set to request a reconciliation poll
+_first_poll = threading.Event()
+_rendered = httpserver.RenderCache()
+_clock = exposition.SourceClock()  # source timestamps for the last poll or event
+selfmetrics.cache_age("snapshot", lambda: time.time() - _cached_data["updated_at"] if _cached_data else None)
+
+EVENTS_TOTAL = exposition.Family("nest_events_total", "counter", "SDM events received on /events")
+LAST_SUCCESSFUL_POLL = exposition.Family(
+    "nest_last_successful_poll_timestamp_seconds", "gauge", "Unix time of the last successful SDM poll"
+)
+POLL_ERRORS_TOTAL = exposition.Family("nest_poll_errors_total", "counter", "Failed SDM polls")
+TOKEN_EXPIRY = exposition.Family(
+    "nest_access_token_expiry_timestamp_seconds", "gauge", "Unix time the current OAuth access token expires"
+)
+POLL_INTERVAL_SECONDS = exposition.Family(
+    "nest_poll_interval_seconds", "gauge", "Current SDM poll interval chosen by the scheduler"
+)
+SDM_CALLS_24H = exposition.Family("nest_sdm_calls_24h", "gauge", "SDM API calls made in the last 24 hours")
+SDM_BUDGET_24H = exposition.Family("nest_sdm_call_budget_24h", "gauge", "SDM API call budget per 24 hours")
+
+# Parsed fields whose change switches polling to ACTIVE_POLL_INTERVAL for ACTIVE_HOLD seconds
+CHANGE_FIELDS = ("target_heat_c", "target_cool_c", "mode", "eco_mode")
+DAY = 86400
+TIMESTAMP_STEP = 0.001  # exposition timestamps have millisecond resolution
+
+
+def _gauge(name, help_text):
+    return exposition.Family(name, "gauge", help_text)
+
+
+# Descriptor table: (parsed thermostat field, JSON summary key or None, JSON converter, metric family or None).
+# Drives both /metrics (one family per row, one series per thermostat) and the / summary.
+FIELDS = [
+    ("ambient_temp_c", "temperature_c", None,
+     _gauge("nest_ambient_temperature_celsius", "Current room temperature in Celsius")),
+    ("ambient_temp_f", "temperature_f", None,
+     _gauge("nest_ambient_temperature_fahrenheit", "Current room temperature in Fahrenheit")),
+    ("target_heat_c", None, None,
+     _gauge("nest_target_temperature_heat_celsius", "Heat setpoint in Celsius")),
+    ("target_heat_f", "target_heat_f", None,
+     _gauge("nest_target_temperature_heat_fahrenheit", "Heat setpoint in Fahrenheit")),
+    ("target_cool_c", None, None,
+     _gauge("nest_target_temperature_cool_celsius", "Cool setpoint in Celsius")),
+    ("target_cool_f", "target_cool_f", None,
+     _gauge("nest_target_temperature_cool_fahrenheit", "Cool setpoint in Fahrenheit")),
+    ("humidity", "humidity", None,
+     _gauge("nest_humidity_percent", "Current room humidity percentage")),
+    ("hvac_status", None, None,
+     _gauge("nest_hvac_status", "HVAC status: 0=OFF, 1=HEATING, 2=COOLING")),
+    ("hvac_str", "hvac_status", None, None),
+    ("mode", None, None,
+     _gauge("nest_thermostat_mode", "Thermostat mode: 0=OFF, 1=HEAT, 2=COOL, 3=HEATCOOL")),
+    ("mode_str", "mode", None, None),
+    ("eco_mode", None, None,
+     _gauge("nest_eco_mode", "Eco mode: 0=OFF, 1=MANUAL_ECO")),
+    ("eco_str", "eco_mode", None, None),
+    ("eco_heat_c", None, None,
+     _gauge("nest_eco_temperature_heat_celsius", "Eco heat setpoint in Celsius")),
+    ("eco_heat_f", "eco_heat_f", None,
+     _gauge("nest_eco_temperature_heat_fahrenheit", "Eco heat setpoint in Fahrenheit")),
+    ("eco_cool_c", None, None,
+     _gauge("nest_eco_temperature_cool_celsius", "Eco cool setpoint in Celsius")),
+    ("eco_cool_f", "eco_cool_f", None,
+     _gauge("nest_eco_temperature_cool_fahrenheit", "Eco cool setpoint in Fahrenheit")),
+    ("fan_active", "fan_active", bool,
+     _gauge("nest_fan_active", "Fan timer: 0=OFF, 1=ON")),
+    ("fan_timer_end_seconds", None, None,
+     _gauge("nest_fan_timer_end_seconds", "Unix timestamp when fan timer expires")),
+    ("connectivity", "online", bool,
+     _gauge("nest_connectivity", "Device connectivity: 0=OFFLINE, 1=ONLINE")),
+]
+METRIC_FIELDS = [(key, family) for key, _, _, family in FIELDS if family]
+SUMMARY_FIELDS = [(key, summary_key, convert) for key, summary_key, convert, _ in FIELDS if summary_key]
+
+
+def _save_token():
+    """Write the access token and its expiry to TOKEN_FILE, readable by the owner only."""
+    tmp = f"{TOKEN_FILE}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"access_token": _access_token, "expires_at": _token_expiry}, f)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, TOKEN_FILE)
+
+
+def load_token():
+    """Restore a still-valid access token from TOKEN_FILE; return True if one was loaded."""
+    global _access_token, _token_expiry
+    try:
+        with open(TOKEN_FILE) as f:
+            saved = json.load(f)
+        access_token, expires_at = saved["access_token"], float(saved["expires_at"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    if expires_at - time.time() < TOKEN_MIN_VALIDITY:
+        return False
+    _access_token, _token_expiry = access_token, expires_at
+    return True
 
 
 def refresh_access_token():
-    """Exchange refresh token for a new access token."""
+    """Exchange refresh token for a new access token and persist it."""
     global _access_token, _token_expiry
     data = urllib.parse.urlencode({
         "client_id": GOOGLE_CLIENT_ID,
@@ -37,27 +197,66 @@ def refresh_access_token():
         "refresh_token": GOOGLE_REFRESH_TOKEN,
         "grant_type": "refresh_token",
     }).encode()
-    req = urllib.request.Request(TOKEN_URL, data=data, method="POST")
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        token_data = json.load(resp)
+    token_data = _oauth.request(
+        "POST", "", body=data, headers={"Content-Type": "application/x-www-form-urlencoded"}
+    ).json()
     _access_token = token_data["access_token"]
-    _token_expiry = time.time() + token_data.get("expires_in", 3600) - 60
+    _token_expiry = time.time() + token_data.get("expires_in", 3600)
+    try:
+        _save_token()
+    except OSError as e:
+        print(f"Could not save token to {TOKEN_FILE}: {e}", flush=True)
 
 
 def get_access_token():
     """Return a valid access token, refreshing if needed."""
-    if _access_token is None or time.time() >= _token_expiry:
-        refresh_access_token()
-    return _access_token
+    with _token_lock:
+        if _access_token is None or time.time() >= _token_expiry - TOKEN_MIN_VALIDITY:
+            refresh_access_token()
+        return _access_token
+
+
+def _token_refresher():
+    """Background loop that refreshes the access token TOKEN_REFRESH_AHEAD seconds before expiry."""
+    failures = 0
+    while True:
+        time.sleep(max(_token_expiry - TOKEN_REFRESH_AHEAD - time.time(), 0))
+        try:
+            with _token_lock:
+                # The poller may already have refreshed it
+                if time.time() >= _token_expiry - TOKEN_REFRESH_AHEAD:
+                    refresh_access_token()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            delay = min(POLL_RETRY * 2 ** (failures - 1), TOKEN_REFRESH_AHEAD / 2) * random.uniform(0.5, 1.0)
+            print(f"Token refresh failed ({failures} in a row), retrying in {delay:.0f}s: {e}", flush=True)
+            time.sleep(delay)
 
 
 def fetch_devices():
-    """Fetch all devices from the SDM API."""
+    """Fetch all devices from the SDM API, refreshing the token once if it was rejected."""
+    global _access_token
+    path = f"/enterprises/{SDM_PROJECT_ID}/devices"
+    try:
+        token = get_access_token()
+        _sdm_calls.append(time.time())
+        return _sdm.get_json(path, headers={"Authorization": f"Bearer {token}"})
+    except httpclient.HTTPError as e:
+        if e.status != 401:
+            raise
+    _access_token = None  # revoked or otherwise invalid before its expiry
     token = get_access_token()
-    url = f"{SDM_API_BASE}/enterprises/{SDM_PROJECT_ID}/devices"
-    req = urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"})
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        return json.load(resp)
+    _sdm_calls.append(time.time())
+    return _sdm.get_json(path, headers={"Authorization": f"Bearer {token}"})
+
+
+def _parse_time(ts_str):
+    """Convert an RFC 3339 timestamp to Unix epoch seconds (None if unparseable)."""
+    try:
+        return datetime.fromisoformat(ts_str.replace("Z", "+00:00")).timestamp()
+    except (ValueError, AttributeError):
+        return None
 
 
 def parse_thermostat(device):
@@ -67,7 +266,9 @@ def parse_thermostat(device):
     # Use the last segment of the device name as a short label
     device_id = name.split("/")[-1] if "/" in name else name
 
-    data = {"device_id": device_id}
+    # The room is the structure/room the device is assigned to in Google Home
+    relations = device.get("parentRelations") or [{}]
+    data = {"device_id": device_id, "room": relations[0].get("displayName", "")}
 
     # Temperature (SDM API returns Celsius)
     temp_trait = traits.get("sdm.devices.traits.Temperature", {})
@@ -128,12 +329,9 @@ def parse_thermostat(device):
     data["fan_active"] = 1 if fan_str == "ON" else 0
     if "timerTimeout" in fan_trait:
         # Convert RFC 3339 timestamp to Unix epoch for Prometheus
-        ts_str = fan_trait["timerTimeout"]
-        try:
-            dt = datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
-            data["fan_timer_end_seconds"] = dt.timestamp()
-        except (ValueError, AttributeError):
-            pass
+        timer_end = _parse_time(fan_trait["timerTimeout"])
+        if timer_end is not None:
+            data["fan_timer_end_seconds"] = timer_end
 
     # Connectivity
     conn_trait = traits.get("sdm.devices.traits.Connectivity", {})
@@ -143,185 +341,266 @@ def parse_thermostat(device):
     return data
 
 
-def poll_thermostat():
-    """Poll the SDM API and cache the result."""
-    global _cached_data, _last_poll
-    now = time.time()
-    if _cached_data and (now - _last_poll) < POLL_INTERVAL:
-        return _cached_data
+def _publish(updated_at):
+    """Replace the served snapshot with the current parsed state. Caller holds _state_lock.
+
+    The snapshot time always moves forward: new values published at or
+    before the current one (an event older than the last poll or event) are
+    stamped TIMESTAMP_STEP after it, since Prometheus drops a changed value
+    at a timestamp it has already scraped.
+    """
+    global _cached_data
+    previous = _cached_data.get("updated_at", 0)
+    if updated_at <= previous:
+        updated_at = previous + TIMESTAMP_STEP
+    _cached_data = {"thermostats": list(_parsed.values()), "updated_at": updated_at}
+
+
+def _note_changes(old, new, when):
+    """Record a setpoint/mode change between two parses of the same thermostat."""
+    global _last_change
+    if old is not None and any(old.get(key) != new.get(key) for key in CHANGE_FIELDS):
+        _last_change = max(_last_change, when)
+
 
+def poll_thermostats():
+    """Poll the SDM API and replace the cached state with the result.
+
+    Traits updated by an event after the poll started keep the event's
+    value.
+    """
+    global _devices, _parsed, _known_devices, _last_poll
+    now = time.time()
     devices_resp = fetch_devices()
     devices = devices_resp.get("devices", [])
 
-    # Find the first thermostat
-    for device in devices:
-        device_type = device.get("type", "")
-        if "THERMOSTAT" in device_type:
-            _cached_data = parse_thermostat(device)
-            _last_poll = now
-            return _cached_data
-
-    return {}
-
-
-def build_metrics(data):
-    """Build Prometheus metrics text from thermostat data."""
-    if not data:
-        return "# No thermostat data available\n"
-
-    lines = []
-
-    if "ambient_temp_c" in data:
-        lines.append("# HELP nest_ambient_temperature_celsius Current room temperature in Celsius")
-        lines.append("# TYPE nest_ambient_temperature_celsius gauge")
-        lines.append(f"nest_ambient_temperature_celsius {data['ambient_temp_c']}")
-
-    if "ambient_temp_f" in data:
-        lines.append("# HELP nest_ambient_temperature_fahrenheit Current room temperature in Fahrenheit")
-        lines.append("# TYPE nest_ambient_temperature_fahrenheit gauge")
-        lines.append(f"nest_ambient_temperature_fahrenheit {data['ambient_temp_f']}")
-
-    if "target_heat_c" in data:
-        lines.append("# HELP nest_target_temperature_heat_celsius Heat setpoint in Celsius")
-        lines.append("# TYPE nest_target_temperature_heat_celsius gauge")
-        lines.append(f"nest_target_temperature_heat_celsius {data['target_heat_c']}")
-
-    if "target_heat_f" in data:
-        lines.append("# HELP nest_target_temperature_heat_fahrenheit Heat setpoint in Fahrenheit")
-        lines.append("# TYPE nest_target_temperature_heat_fahrenheit gauge")
-        lines.append(f"nest_target_temperature_heat_fahrenheit {data['target_heat_f']}")
-
-    if "target_cool_c" in data:
-        lines.append("# HELP nest_target_temperature_cool_celsius Cool setpoint in Celsius")
-        lines.append("# TYPE nest_target_temperature_cool_celsius gauge")
-        lines.append(f"nest_target_temperature_cool_celsius {data['target_cool_c']}")
-
-    if "target_cool_f" in data:
-        lines.append("# HELP nest_target_temperature_cool_fahrenheit Cool setpoint in Fahrenheit")
-        lines.append("# TYPE nest_target_temperature_cool_fahrenheit gauge")
-        lines.append(f"nest_target_temperature_cool_fahrenheit {data['target_cool_f']}")
-
-    if "humidity" in data:
-        lines.append("# HELP nest_humidity_percent Current room humidity percentage")
-        lines.append("# TYPE nest_humidity_percent gauge")
-        lines.append(f"nest_humidity_percent {data['humidity']}")
-
-    if "hvac_status" in data:
-        lines.append("# HELP nest_hvac_status HVAC status: 0=OFF, 1=HEATING, 2=COOLING")
-        lines.append("# TYPE nest_hvac_status gauge")
-        lines.append(f"nest_hvac_status {data['hvac_status']}")
-
-    if "mode" in data:
-        lines.append("# HELP nest_thermostat_mode Thermostat mode: 0=OFF, 1=HEAT, 2=COOL, 3=HEATCOOL")
-        lines.append("# TYPE nest_thermostat_mode gauge")
-        lines.append(f"nest_thermostat_mode {data['mode']}")
-
-    if "eco_mode" in data:
-        lines.append("# HELP nest_eco_mode Eco mode: 0=OFF, 1=MANUAL_ECO")
-        lines.append("# TYPE nest_eco_mode gauge")
-        lines.append(f"nest_eco_mode {data['eco_mode']}")
-
-    if "eco_heat_c" in data:
-        lines.append("# HELP nest_eco_temperature_heat_celsius Eco heat setpoint in Celsius")
-        lines.append("# TYPE nest_eco_temperature_heat_celsius gauge")
-        lines.append(f"nest_eco_temperature_heat_celsius {data['eco_heat_c']}")
-
-    if "eco_heat_f" in data:
-        lines.append("# HELP nest_eco_temperature_heat_fahrenheit Eco heat setpoint in Fahrenheit")
-        lines.append("# TYPE nest_eco_temperature_heat_fahrenheit gauge")
-        lines.append(f"nest_eco_temperature_heat_fahrenheit {data['eco_heat_f']}")
-
-    if "eco_cool_c" in data:
-        lines.append("# HELP nest_eco_temperature_cool_celsius Eco cool setpoint in Celsius")
-        lines.append("# TYPE nest_eco_temperature_cool_celsius gauge")
-        lines.append(f"nest_eco_temperature_cool_celsius {data['eco_cool_c']}")
-
-    if "eco_cool_f" in data:
-        lines.append("# HELP nest_eco_temperature_cool_fahrenheit Eco cool setpoint in Fahrenheit")
-        lines.append("# TYPE nest_eco_temperature_cool_fahrenheit gauge")
-        lines.append(f"nest_eco_temperature_cool_fahrenheit {data['eco_cool_f']}")
-
-    if "fan_active" in data:
-        lines.append("# HELP nest_fan_active Fan timer: 0=OFF, 1=ON")
-        lines.append("# TYPE nest_fan_active gauge")
-        lines.append(f"nest_fan_active {data['fan_active']}")
-
-    if "fan_timer_end_seconds" in data:
-        lines.append("# HELP nest_fan_timer_end_seconds Unix timestamp when fan timer expires")
-        lines.append("# TYPE nest_fan_timer_end_seconds gauge")
-        lines.append(f"nest_fan_timer_end_seconds {data['fan_timer_end_seconds']}")
-
-    if "connectivity" in data:
-        lines.append("# HELP nest_connectivity Device connectivity: 0=OFFLINE, 1=ONLINE")
-        lines.append("# TYPE nest_connectivity gauge")
-        lines.append(f"nest_connectivity {data['connectivity']}")
-
-    return "\n".join(lines) + "\n"
-
-
-def build_json_summary(data):
-    """Build a JSON summary for Homepage widget consumption (Fahrenheit values)."""
-    if not data:
-        return json.dumps({"error": "no data"})
+    with _state_lock:
+        thermostats = {}
+        for device in devices:
+            if "THERMOSTAT" not in device.get("type", ""):
+                continue
+            name = device.get("name", "unknown")
+            previous = _devices.get(name, {}).get("traits", {})
+            traits = device.setdefault("traits", {})
+            for trait in list(traits) + list(previous):
+                if _trait_updated.get((name, trait), 0) > now and trait in previous:
+                    traits[trait] = previous[trait]
+                else:
+                    _trait_updated[(name, trait)] = now
+            thermostats[name] = device
+        _devices = thermostats
+        parsed = {name: parse_thermostat(device) for name, device in thermostats.items()}
+        for name, data in parsed.items():
+            _note_changes(_parsed.get(name), data, now)
+        _parsed = parsed
+        _known_devices = {device.get("name") for device in devices}
+        _last_poll = now
+        _publish(now)
+    _first_poll.set()
+
+
+def _desired_interval(now):
+    """Poll interval for the current thermostat state, before budget limits."""
+    if now - _last_event < RECONCILE_INTERVAL:
+        return RECONCILE_INTERVAL
+    thermostats = list(_parsed.values())
+    if thermostats and not any(data.get("connectivity") for data in thermostats):
+        return OFFLINE_POLL_INTERVAL
+    if any(data.get("hvac_status") for data in thermostats) or now - _last_change < ACTIVE_HOLD:
+        return ACTIVE_POLL_INTERVAL
+    return POLL_INTERVAL
+
+
+def _calls_used(now):
+    """Prune the call log and return (calls in the last 24h, calls in the last minute)."""
+    while _sdm_calls and _sdm_calls[0] <= now - DAY:
+        _sdm_calls.popleft()
+    return len(_sdm_calls), sum(1 for t in reversed(_sdm_calls) if t > now - 60)
+
+
+def _poll_interval():
+    """Seconds between polls: the state's interval, slowed to fit the call budget.
+
+    Polling runs at the state's interval while the rolling 24h budget has
+    more than a day of idle polling left. Below that reserve the remaining
+    calls are spread evenly over the next 24 hours, so a long heating day
+    slows polling down before the budget runs out rather than after.
+    """
+    global _poll_interval_current
+    now = time.time()
+    used, _ = _calls_used(now)
+    remaining = POLL_BUDGET_PER_DAY - used
+    interval = _desired_interval(now)
+    if remaining <= DAY / POLL_INTERVAL:
+        interval = max(interval, DAY / max(remaining, 1))
+    _poll_interval_current = interval
+    return interval
 
-    summary = {}
-    if "ambient_temp_f" in data:
-        summary["temperature_f"] = data["ambient_temp_f"]
-    if "ambient_temp_c" in data:
-        summary["temperature_c"] = data["ambient_temp_c"]
-    if "target_heat_f" in data:
-        summary["target_heat_f"] = data["target_heat_f"]
-    if "target_cool_f" in data:
-        summary["target_cool_f"] = data["target_cool_f"]
-    if "humidity" in data:
-        summary["humidity"] = data["humidity"]
-    if "hvac_str" in data:
-        summary["hvac_status"] = data["hvac_str"]
-    if "mode_str" in data:
-        summary["mode"] = data["mode_str"]
-    if "eco_str" in data:
-        summary["eco_mode"] = data["eco_str"]
-    if "eco_heat_f" in data:
-        summary["eco_heat_f"] = data["eco_heat_f"]
-    if "eco_cool_f" in data:
-        summary["eco_cool_f"] = data["eco_cool_f"]
-    if "fan_active" in data:
-        summary["fan_active"] = bool(data["fan_active"])
-    if "connectivity" in data:
-        summary["online"] = bool(data["connectivity"])
 
+def _quota_wait():
+    """Seconds until another SDM call fits the per-minute and per-day limits."""
+    now = time.time()
+    used, last_minute = _calls_used(now)
+    wait = 0
+    if last_minute >= POLL_BUDGET_PER_MINUTE:
+        wait = _sdm_calls[-POLL_BUDGET_PER_MINUTE] + 60 - now
+    if used >= POLL_BUDGET_PER_DAY:
+        wait = max(wait, _sdm_calls[used - POLL_BUDGET_PER_DAY] + DAY - now)
+    return max(wait, 0)
+
+
+def _poller():
+    """Background loop that polls when due and backs off exponentially after failures."""
+    global _poll_errors_total
+    failures = 0
+    while True:
+        time.sleep(_quota_wait())
+        _poll_now.clear()
+        try:
+            poll_thermostats()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            _poll_errors_total += 1
+            delay = min(POLL_RETRY * 2 ** (failures - 1), POLL_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+            print(f"Poll failed ({failures} in a row), retrying in {delay:.0f}s: {e}", flush=True)
+            time.sleep(delay)
+            continue
+        # Re-check often enough to speed up when events stop or a thermostat starts heating
+        while not _poll_now.is_set():
+            remaining = _last_poll + _poll_interval() - time.time()
+            if remaining <= 0:
+                break
+            _poll_now.wait(min(remaining, ACTIVE_POLL_INTERVAL))
+
+
+def _snapshot():
+    """Return the last good snapshot ({} if there is none yet), never calling Google."""
+    _first_poll.wait(REQUEST_WAIT)
+    selfmetrics.cache_lookup("snapshot", hit=bool(_cached_data.get("thermostats")))
+    return _cached_data
+
+
+def apply_event(event):
+    """Patch the cached state with one SDM event (the decoded Pub/Sub message data).
+
+    Trait updates re-parse only the device they name. Updates older than
+    the cached trait value are ignored, since Pub/Sub may deliver out of
+    order. Relation changes (rooms, added/removed devices) and updates for
+    unknown devices wake the poller for a reconciliation poll. Every event
+    is counted, but only trait updates for a known thermostat switch polling
+    to RECONCILE_INTERVAL.
+    """
+    global _last_event, _events_total
+    received = time.time()
+    changed_at = _parse_time(event.get("timestamp")) or received
+    update = event.get("resourceUpdate") or {}
+    name = update.get("name")
+
+    with _state_lock:
+        _events_total += 1
+        if "relationUpdate" in event or (name and name not in _known_devices):
+            _poll_now.set()
+            return
+        device = _devices.get(name)
+        if device is None or not update.get("traits"):
+            return  # non-thermostat device, or an event without trait data
+        _last_event = received  # only thermostat traffic slows polling to RECONCILE_INTERVAL
+
+        traits = device.setdefault("traits", {})
+        changed = False
+        for trait, fields in update["traits"].items():
+            if _trait_updated.get((name, trait), 0) > changed_at:
+                continue
+            traits[trait] = {**traits.get(trait, {}), **fields}
+            _trait_updated[(name, trait)] = changed_at
+            changed = True
+        if changed:
+            data = parse_thermostat(device)
+            _note_changes(_parsed.get(name), data, changed_at)
+            _parsed[name] = data
+            _publish(changed_at)
+
+
+def build_metrics(snapshot, fmt=exposition.TEXT, timestamp=None):
+    """Build the metrics body in `fmt` for every thermostat, stamped with `timestamp` if given."""
+    thermostats = [
+        (data, (("device_id", data["device_id"]), ("room", data["room"])))
+        for data in snapshot.get("thermostats", [])
+    ]
+    samples = [
+        (family, labels, data[key])
+        for key, family in METRIC_FIELDS
+        for data, labels in thermostats
+        if key in data
+    ]
+    return exposition.render(samples, fmt, timestamp=timestamp)
+
+
+def _summarize(data):
+    return {
+        summary_key: convert(data[key]) if convert else data[key]
+        for key, summary_key, convert in SUMMARY_FIELDS
+        if key in data
+    }
+
+
+def build_json_summary(snapshot):
+    """Build a JSON summary for Homepage widget consumption (Fahrenheit values).
+
+    The top-level fields describe the first thermostat, so single-thermostat
+    widget mappings keep working; `thermostats` lists every thermostat.
+    """
+    thermostats = snapshot.get("thermostats", [])
+    if not thermostats:
+        return json.dumps({"error": "no data"})
+
+    summary = _summarize(thermostats[0])
+    summary["thermostats"] = [
+        {"device_id": data["device_id"], "room": data["room"], **_summarize(data)} for data in thermostats
+    ]
     return json.dumps(summary, indent=2)
 
 
-class NestHandler(BaseHTTPRequestHandler):
+class NestHandler(httpserver.RequestHandler):
+    routes = frozenset({"/", "/health", "/metrics", "/events"})
+
+    def health_status(self):
+        online = any(data.get("connectivity") for data in _cached_data.get("thermostats", []))
+        return "ok" if online else "no_data"
+
     def do_GET(self):
         if self.path == "/metrics":
             try:
-                data = poll_thermostat()
-                output = build_metrics(data)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(output.encode())
+                snapshot = _snapshot()
+                fmt = self.metrics_format()
+                # Idle, offline and event-driven polls are 300-900s apart, past Prometheus' lookback
+                timestamp = _clock.timestamp(snapshot.get("updated_at"))
+                rendered = _rendered.get(
+                    ("metrics", fmt.name), (snapshot, timestamp), lambda: build_metrics(snapshot, fmt, timestamp)
+                )
+                status = [
+                    (LAST_SUCCESSFUL_POLL, (), _last_poll),
+                    (POLL_ERRORS_TOTAL, (), _poll_errors_total),
+                    (EVENTS_TOTAL, (), _events_total),
+                    (TOKEN_EXPIRY, (), _token_expiry),
+                    (POLL_INTERVAL_SECONDS, (), round(_poll_interval_current, 1)),
+                    (SDM_CALLS_24H, (), len(_sdm_calls)),
+                    (SDM_BUDGET_24H, (), POLL_BUDGET_PER_DAY),
+                ]
+                self.send_metrics(rendered, fmt, tail=exposition.render(status, fmt))
             except Exception as e:
                 self.send_response(500)
                 self.send_header("Content-Type", "text/plain")
                 self.end_headers()
                 self.wfile.write(f"# error: {e}\n".encode())
         elif self.path == "/health":
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            status = "ok" if _cached_data.get("connectivity") else "no_data"
-            self.wfile.write(json.dumps({"status": status}).encode())
+            self.send_health()
         elif self.path == "/":
             try:
-                data = poll_thermostat()
-                output = build_json_summary(data)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(output.encode())
+                snapshot = _snapshot()
+                rendered = _rendered.get("json", snapshot, lambda: build_json_summary(snapshot).encode())
+                self.send_rendered(rendered, httpserver.JSON_CONTENT_TYPE)
             except Exception as e:
                 self.send_response(500)
                 self.send_header("Content-Type", "application/json")
@@ -330,8 +609,26 @@ class NestHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404)
 
-    def log_message(self, format, *args):
-        pass
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/events":
+            self.send_error(404)
+            return
+        token = urllib.parse.parse_qs(url.query).get("token", [""])[0]
+        if EVENTS_TOKEN and not hmac.compare_digest(token, EVENTS_TOKEN):
+            self.send_error(403)
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            envelope = json.loads(body)
+            event = json.loads(base64.b64decode(envelope["message"]["data"]))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, f"Not a Pub/Sub push message: {e}")
+            return
+        apply_event(event)
+        # Any 2xx acknowledges the message to Pub/Sub
+        self.send_response(204)
+        self.end_headers()
 
 
 if __name__ == "__main__":
@@ -351,6 +648,15 @@ if __name__ == "__main__":
 
     print(f"Starting nest-exporter on port {PORT}")
     print(f"SDM Project: {SDM_PROJECT_ID}")
-    print(f"Poll interval: {POLL_INTERVAL}s")
-    server = HTTPServer(("0.0.0.0", PORT), NestHandler)
-    server.serve_forever()
+    print(
+        f"Poll interval: {ACTIVE_POLL_INTERVAL}s active, {POLL_INTERVAL}s idle, {OFFLINE_POLL_INTERVAL}s offline, "
+        f"{RECONCILE_INTERVAL}s while events arrive on /events"
+    )
+    print(f"SDM call budget: {POLL_BUDGET_PER_DAY}/day, {POLL_BUDGET_PER_MINUTE}/minute")
+    if not EVENTS_TOKEN:
+        print("WARNING: EVENTS_TOKEN is not set; /events accepts unauthenticated pushes")
+    if load_token():
+        print(f"Reusing saved access token (expires in {_token_expiry - time.time():.0f}s)")
+    threading.Thread(target=_token_refresher, daemon=True).start()
+    threading.Thread(target=_poller, daemon=True).start()
+    httpserver.serve(NestHandler, PORT)
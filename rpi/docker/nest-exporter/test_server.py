@@ -0,0 +1,97 @@
+"""Tests for event handling in nest-exporter.
+
+    cd rpi/docker/nest-exporter && PYTHONPATH=../shared python -m unittest test_server
+"""
+
+import unittest
+from unittest import mock
+
+import server
+
+DEVICE = "enterprises/test/devices/thermostat0"
+
+
+def _device(**traits):
+    return {
+        "name": DEVICE,
+        "type": "sdm.devices.types.THERMOSTAT",
+        "traits": {
+            "sdm.devices.traits.Temperature": {"ambientTemperatureCelsius": 20.0},
+            "sdm.devices.traits.Connectivity": {"status": "ONLINE"},
+            **traits,
+        },
+    }
+
+
+def _event(when, trait, fields):
+    return {
+        "timestamp": f"1970-01-01T00:{when // 60:02d}:{when % 60:02d}Z",
+        "resourceUpdate": {"name": DEVICE, "traits": {trait: fields}},
+    }
+
+
+class EventTimestampTest(unittest.TestCase):
+    def setUp(self):
+        server._devices, server._parsed, server._known_devices = {}, {}, set()
+        server._trait_updated, server._cached_data = {}, {}
+        server._last_change = server._last_event = 0
+
+    def _poll(self, at, device):
+        with mock.patch.object(server, "fetch_devices", return_value={"devices": [device]}), \
+                mock.patch.object(server.time, "time", return_value=at):
+            server.poll_thermostats()
+
+    def _apply(self, event, received):
+        with mock.patch.object(server.time, "time", return_value=received):
+            server.apply_event(event)
+
+    def test_event_older_than_poll_is_stamped_after_it(self):
+        self._poll(1000, _device())
+        self._apply(_event(990, "sdm.devices.traits.ThermostatHvac", {"status": "HEATING"}), received=1001)
+
+        snapshot = server._cached_data
+        self.assertEqual(snapshot["thermostats"][0]["hvac_status"], 1)
+        self.assertGreater(snapshot["updated_at"], 1000)
+
+    def test_out_of_order_events_keep_moving_forward(self):
+        self._poll(1000, _device())
+        self._apply(_event(1010, "sdm.devices.traits.Temperature", {"ambientTemperatureCelsius": 21.0}), 1011)
+        stamped = server._cached_data["updated_at"]
+        self._apply(_event(1005, "sdm.devices.traits.ThermostatHvac", {"status": "COOLING"}), 1012)
+
+        snapshot = server._cached_data
+        self.assertEqual(snapshot["thermostats"][0]["hvac_status"], 2)
+        self.assertGreater(int(snapshot["updated_at"] * 1000), int(stamped * 1000))
+
+    def test_event_older_than_cached_trait_is_ignored(self):
+        self._poll(1000, _device())
+        self._apply(_event(990, "sdm.devices.traits.Temperature", {"ambientTemperatureCelsius": 30.0}), 1001)
+
+        snapshot = server._cached_data
+        self.assertEqual(snapshot["thermostats"][0]["ambient_temp_c"], 20.0)
+        self.assertEqual(snapshot["updated_at"], 1000)
+
+
+class EventPollingTest(unittest.TestCase):
+    def setUp(self):
+        server._devices, server._parsed, server._known_devices = {}, {}, set()
+        server._trait_updated, server._cached_data = {}, {}
+        server._last_event = server._events_total = 0
+
+    def test_only_thermostat_events_slow_polling(self):
+        camera = "enterprises/test/devices/camera0"
+        with mock.patch.object(server, "fetch_devices", return_value={"devices": [_device(), {"name": camera}]}), \
+                mock.patch.object(server.time, "time", return_value=1000):
+            server.poll_thermostats()
+        with mock.patch.object(server.time, "time", return_value=1001):
+            server.apply_event({"resourceUpdate": {"name": camera, "events": {}}})
+            server.apply_event({"resourceUpdate": {"name": DEVICE}})
+        self.assertEqual((server._events_total, server._last_event), (2, 0))
+
+        with mock.patch.object(server.time, "time", return_value=1002):
+            server.apply_event(_event(1002, "sdm.devices.traits.Humidity", {"ambientHumidityPercent": 50}))
+        self.assertEqual((server._events_total, server._last_event), (3, 1002))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,87 +3,197 @@
 
 Calculates actual document storage by issuing HEAD requests against
 each document's download endpoint and summing Content-Length headers.
-Results are cached to avoid hammering the API on every refresh.
+Sizes are kept in a small SQLite index keyed by document id and modified
+timestamp, so only new or changed documents are HEADed on each refresh.
+Document pages and HEAD requests are fanned out over a bounded worker pool
+sharing a pool of keep-alive connections to Paperless.
+Results are cached and recomputed by a background thread shortly before they
+expire; requests are always answered from the last good snapshot, rendered
+(and gzipped) once per snapshot.
 """
 
+import collections
+import itertools
 import json
+import math
 import os
+import sqlite3
+import threading
 import time
-import urllib.request
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+import exposition
+import httpclient
+import httpserver
+import jsonstream
+import selfmetrics
+import singleflight
 
 PAPERLESS_URL = os.environ.get("PAPERLESS_URL", "http://localhost:8776")
 PAPERLESS_TOKEN = os.environ.get("PAPERLESS_TOKEN", "")
 PORT = int(os.environ.get("PORT", "8080"))
 CACHE_TTL = int(os.environ.get("CACHE_TTL", "300"))  # 5 minutes
+REFRESH_AHEAD = int(os.environ.get("REFRESH_AHEAD", "60"))  # refresh this long before expiry
+REFRESH_RETRY = 30  # seconds between attempts after a failed refresh
+SIZE_INDEX_PATH = os.environ.get("SIZE_INDEX_PATH", "/data/size-index.db")
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "8"))
+PAGE_SIZE = 100
+# "unacknowledged" asks Paperless only for tasks not yet dismissed in the UI; "all" reads every task
+TASK_TRACKING = os.environ.get("TASK_TRACKING", "unacknowledged")
+TASK_LIMIT = int(os.environ.get("TASK_LIMIT", "500"))  # most recent tasks to track
 
 _cache = {"data": None, "timestamp": 0}
+_refresh = singleflight.SingleFlight()
+_paperless = httpclient.Client(
+    PAPERLESS_URL,
+    headers={"Authorization": f"Token {PAPERLESS_TOKEN}", "Accept": "application/json"},
+    pool_size=FETCH_CONCURRENCY,
+)
+_pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="paperless")
+_tracked_tasks = {}  # task id -> (status, task name)
+_task_counts = collections.Counter()  # (status, task name) -> number of tracked tasks
+_rendered = httpserver.RenderCache()
+_clock = exposition.SourceClock()  # source timestamps for the stats snapshot
+selfmetrics.cache_age("stats", lambda: time.time() - _cache["timestamp"] if _cache["data"] else None)
 
-
-def _headers():
-    return {"Authorization": f"Token {PAPERLESS_TOKEN}", "Accept": "application/json"}
+DOCUMENTS = exposition.Family("paperless_documents_total", "gauge", "Total number of documents")
+STORAGE = exposition.Family("paperless_storage_bytes", "gauge", "Total size of all documents in bytes")
+CHARACTERS = exposition.Family("paperless_character_count", "gauge", "Total characters across all documents")
+TASKS_ACTIVE = exposition.Family("paperless_tasks_active", "gauge", "Currently running tasks")
+TASKS_PENDING = exposition.Family("paperless_tasks_pending", "gauge", "Pending tasks in queue")
+TASKS_FAILED = exposition.Family("paperless_tasks_failed", "gauge", "Failed tasks")
+TASKS_BY_TYPE = exposition.Family("paperless_tasks_by_type", "gauge", "Tracked tasks by task name and status")
+DOCUMENTS_BY_TYPE = exposition.Family("paperless_documents_by_type", "gauge", "Documents by MIME type")
+STATS_AGE = exposition.Family("paperless_stats_age_seconds", "gauge", "Seconds since the served stats were computed")
 
 
 def _fetch_json(path):
     """Fetch JSON from Paperless API."""
-    req = urllib.request.Request(f"{PAPERLESS_URL}{path}", headers=_headers())
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        return json.load(resp)
+    return _paperless.get_json(path)
 
 
 def _head(path):
-    """Issue HEAD request, return Content-Length or 0."""
-    req = urllib.request.Request(f"{PAPERLESS_URL}{path}", method="HEAD", headers=_headers())
+    """Issue HEAD request, return Content-Length (0 if absent) or None on failure."""
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return int(resp.headers.get("Content-Length", 0))
+        return int(_paperless.head(path).headers.get("Content-Length", 0))
     except Exception:
-        return 0
+        return None
+
+
+def _iter_json_array(path):
+    """Yield the elements of a JSON array response (or a paginated response's "results") one at a time."""
+    with _paperless.stream("GET", path) as resp:
+        yield from jsonstream.iter_array(resp, key="results", source=f"GET {path}")
+
+
+def _open_size_index():
+    """Open (creating if needed) the persistent document size index."""
+    directory = os.path.dirname(SIZE_INDEX_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(SIZE_INDEX_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS doc_sizes ("
+        "id INTEGER PRIMARY KEY, modified TEXT NOT NULL, size INTEGER NOT NULL)"
+    )
+    return conn
+
+
+def _documents_page(page):
+    """One page of document ids, ordered by id so documents added mid-scan land after every page."""
+    return _fetch_json(f"/api/documents/?page={page}&page_size={PAGE_SIZE}&ordering=id&fields=id,modified")
 
 
 def _calculate_storage():
-    """Sum actual document sizes via HEAD requests on download endpoints."""
-    total_size = 0
-    page = 1
-    while True:
-        data = _fetch_json(f"/api/documents/?page={page}&page_size=100&fields=id")
-        for doc in data.get("results", []):
-            total_size += _head(f"/api/documents/{doc['id']}/download/")
-        if not data.get("next"):
-            break
-        page += 1
-    return total_size
+    """Sum document sizes, HEADing only documents that are new or modified.
+
+    The first page reports the total count, after which the remaining pages
+    are fetched in parallel. Documents that failed to HEAD are retried on
+    the next refresh; documents no longer listed by Paperless are dropped.
+    """
+    first = _documents_page(1)
+    last_page = max(1, math.ceil(first.get("count", 0) / PAGE_SIZE))
+    pages = [first, *_pool.map(_documents_page, range(2, last_page + 1))]
+
+    conn = _open_size_index()
+    try:
+        known = dict(conn.execute("SELECT id, modified FROM doc_sizes"))
+        seen = set()
+        changed = []
+        for data in pages:
+            for doc in data.get("results", []):
+                doc_id = doc["id"]
+                modified = doc.get("modified") or ""
+                seen.add(doc_id)
+                if known.get(doc_id) != modified:
+                    changed.append((doc_id, modified))
+
+        sizes = _pool.map(_head, (f"/api/documents/{doc_id}/download/" for doc_id, _ in changed))
+        conn.executemany(
+            "INSERT OR REPLACE INTO doc_sizes (id, modified, size) VALUES (?, ?, ?)",
+            ((doc_id, modified, size) for (doc_id, modified), size in zip(changed, sizes) if size is not None),
+        )
+        conn.executemany(
+            "DELETE FROM doc_sizes WHERE id = ?",
+            ((doc_id,) for doc_id in known.keys() - seen),
+        )
+        conn.commit()
+        (total_size,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM doc_sizes").fetchone()
+        return total_size
+    finally:
+        conn.close()
 
 
 def _fetch_tasks():
-    """Fetch task counts by status from Paperless tasks API."""
+    """Update the tracked task table and return task counts.
+
+    Only the most recent TASK_LIMIT tasks are read, streamed one at a time
+    (filtered to unacknowledged tasks by default). Counts are adjusted only
+    for tasks that appeared, changed status or disappeared since the last
+    refresh; on a failed fetch the previous counts are kept.
+    """
+    global _tracked_tasks
+    path = "/api/tasks/?acknowledged=false" if TASK_TRACKING == "unacknowledged" else "/api/tasks/"
     try:
-        tasks = _fetch_json("/api/tasks/")
-        counts = {"active": 0, "pending": 0, "failed": 0}
-        for task in tasks:
-            status = task.get("status", "").upper()
-            if status == "STARTED":
-                counts["active"] += 1
-            elif status == "PENDING":
-                counts["pending"] += 1
-            elif status == "FAILURE":
-                counts["failed"] += 1
-        return counts
+        current = {}
+        for position, task in enumerate(itertools.islice(_iter_json_array(path), TASK_LIMIT)):
+            task_id = task.get("task_id") or task.get("id") or position
+            task_name = task.get("task_name") or task.get("type") or "unknown"
+            current[task_id] = (task.get("status", "").upper(), task_name)
     except Exception:
-        return {"active": 0, "pending": 0, "failed": 0}
+        current = _tracked_tasks
 
+    for task_id, entry in _tracked_tasks.items():
+        if current.get(task_id) != entry:
+            _task_counts[entry] -= 1
+    for task_id, entry in current.items():
+        if _tracked_tasks.get(task_id) != entry:
+            _task_counts[entry] += 1
+    for entry in [entry for entry, count in _task_counts.items() if not count]:
+        del _task_counts[entry]
+    _tracked_tasks = current
 
-def _get_stats():
-    """Get stats, using cache if fresh."""
-    now = time.time()
-    if _cache["data"] and (now - _cache["timestamp"]) < CACHE_TTL:
-        return _cache["data"]
+    by_status = collections.Counter()
+    for (status, _), count in _task_counts.items():
+        by_status[status] += count
+    return {
+        "active": by_status["STARTED"],
+        "pending": by_status["PENDING"],
+        "failed": by_status["FAILURE"],
+        "by_type": sorted((name, status.lower(), count) for (status, name), count in _task_counts.items()),
+    }
 
+
+def _compute_stats():
+    """Query Paperless and build a fresh stats snapshot."""
+    collected_at = time.time()
     stats = _fetch_json("/api/statistics/")
-    doc_storage = _calculate_storage()
-    task_counts = _fetch_tasks()
+    with selfmetrics.timer("storage"):
+        doc_storage = _calculate_storage()
+    with selfmetrics.timer("tasks"):
+        task_counts = _fetch_tasks()
 
-    result = {
+    return {
         "documents": stats.get("documents_total", 0),
         "storage_bytes": doc_storage,
         "file_types": stats.get("document_file_type_counts", []),
@@ -91,19 +201,84 @@ def _get_stats():
         "active_tasks": task_counts["active"],
         "pending_tasks": task_counts["pending"],
         "failed_tasks": task_counts["failed"],
+        "tasks_by_type": task_counts["by_type"],
+        "collected_at": collected_at,
     }
 
+
+def _store_stats():
+    with selfmetrics.timer("refresh"):
+        result = _compute_stats()
     _cache["data"] = result
-    _cache["timestamp"] = now
+    _cache["timestamp"] = time.time()
     return result
 
 
-class StatsHandler(BaseHTTPRequestHandler):
+def _refresh_stats():
+    """Recompute stats, coalescing concurrent callers into one upstream computation."""
+    return _refresh.run(_store_stats)
+
+
+def _get_stats():
+    """Get stats from the last good snapshot, computing it only on a cold start."""
+    selfmetrics.cache_lookup("stats", hit=bool(_cache["data"]))
+    if _cache["data"]:
+        return _cache["data"]
+    return _refresh_stats()
+
+
+def _refresher():
+    """Background loop that refreshes the snapshot before it expires."""
+    while True:
+        age = time.time() - _cache["timestamp"]
+        time.sleep(max(CACHE_TTL - REFRESH_AHEAD - age, 0))
+        try:
+            _refresh_stats()
+        except Exception as e:
+            print(f"Refresh failed: {e}", flush=True)
+            time.sleep(REFRESH_RETRY)
+
+
+def _render_json(stats):
+    """Homepage widget body."""
+    result = {
+        "documents": stats["documents"],
+        "storage_bytes": stats["storage_bytes"],
+        "active_tasks": stats["active_tasks"],
+        "pending_tasks": stats["pending_tasks"],
+        "failed_tasks": stats["failed_tasks"],
+    }
+    return json.dumps(result).encode()
+
+
+def _render_metrics(stats, fmt, timestamp):
+    """Metrics body in `fmt`, minus the age gauge that changes on every scrape."""
+    samples = [
+        (DOCUMENTS, (), stats["documents"]),
+        (STORAGE, (), stats["storage_bytes"]),
+        (CHARACTERS, (), stats["character_count"]),
+        (TASKS_ACTIVE, (), stats["active_tasks"]),
+        (TASKS_PENDING, (), stats["pending_tasks"]),
+        (TASKS_FAILED, (), stats["failed_tasks"]),
+    ]
+    for task_name, status, count in stats.get("tasks_by_type", []):
+        samples.append((TASKS_BY_TYPE, (("task_name", task_name), ("status", status)), count))
+    for entry in stats.get("file_types", []):
+        mime = entry.get("mime_type", "unknown")
+        samples.append((DOCUMENTS_BY_TYPE, (("mime_type", mime),), entry.get("mime_type_count", 0)))
+    return exposition.render(samples, fmt, timestamp=timestamp)
+
+
+class StatsHandler(httpserver.RequestHandler):
+    routes = frozenset({"/", "/health", "/metrics"})
+
     def do_GET(self):
         if self.path == "/":
             self._handle_json()
         elif self.path == "/metrics":
             self._handle_metrics()
+        elif self.path == "/health":
+            self.send_health()
         else:
             self.send_error(404)
 
@@ -111,17 +286,8 @@ class StatsHandler(BaseHTTPRequestHandler):
         """JSON endpoint for Homepage widget."""
         try:
             stats = _get_stats()
-            result = {
-                "documents": stats["documents"],
-                "storage_bytes": stats["storage_bytes"],
-                "active_tasks": stats["active_tasks"],
-                "pending_tasks": stats["pending_tasks"],
-                "failed_tasks": stats["failed_tasks"],
-            }
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
+            rendered = _rendered.get("json", stats, lambda: _render_json(stats))
+            self.send_rendered(rendered, httpserver.JSON_CONTENT_TYPE)
 
         except Exception as e:
             self.send_response(500)
@@ -133,38 +299,13 @@ class StatsHandler(BaseHTTPRequestHandler):
         """Prometheus metrics endpoint."""
         try:
             stats = _get_stats()
-
-            lines = [
-                "# HELP paperless_documents_total Total number of documents",
-                "# TYPE paperless_documents_total gauge",
-                f"paperless_documents_total {stats['documents']}",
-                "# HELP paperless_storage_bytes Total size of all documents in bytes",
-                "# TYPE paperless_storage_bytes gauge",
-                f"paperless_storage_bytes {stats['storage_bytes']}",
-                "# HELP paperless_character_count Total characters across all documents",
-                "# TYPE paperless_character_count gauge",
-                f"paperless_character_count {stats['character_count']}",
-                "# HELP paperless_tasks_active Currently running tasks",
-                "# TYPE paperless_tasks_active gauge",
-                f"paperless_tasks_active {stats['active_tasks']}",
-                "# HELP paperless_tasks_pending Pending tasks in queue",
-                "# TYPE paperless_tasks_pending gauge",
-                f"paperless_tasks_pending {stats['pending_tasks']}",
-                "# HELP paperless_tasks_failed Failed tasks",
-                "# TYPE paperless_tasks_failed gauge",
-                f"paperless_tasks_failed {stats['failed_tasks']}",
-            ]
-
-            for entry in stats.get("file_types", []):
-                mime = entry.get("mime_type", "unknown")
-                count = entry.get("mime_type_count", 0)
-                lines.append(f'paperless_documents_by_type{{mime_type="{mime}"}} {count}')
-
-            output = "\n".join(lines) + "\n"
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(output.encode())
+            fmt = self.metrics_format()
+            timestamp = _clock.timestamp(stats["collected_at"])
+            rendered = _rendered.get(
+                ("metrics", fmt.name), (stats, timestamp), lambda: _render_metrics(stats, fmt, timestamp)
+            )
+            age = exposition.render([(STATS_AGE, (), round(time.time() - _cache["timestamp"], 1))], fmt)
+            self.send_metrics(rendered, fmt, tail=age)
 
         except Exception as e:
             self.send_response(500)
@@ -172,13 +313,13 @@ class StatsHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(f"# error: {e}\n".encode())
 
-    def log_message(self, format, *args):
-        pass  # Suppress logging
-
 
 if __name__ == "__main__":
     print(f"Starting Paperless stats proxy on port {PORT}")
     print(f"Proxying to {PAPERLESS_URL}")
-    print(f"Cache TTL: {CACHE_TTL}s")
-    server = HTTPServer(("0.0.0.0", PORT), StatsHandler)
-    server.serve_forever()
+    print(f"Cache TTL: {CACHE_TTL}s (refreshed {REFRESH_AHEAD}s before expiry)")
+    print(f"Size index: {SIZE_INDEX_PATH}")
+    print(f"Fetch concurrency: {FETCH_CONCURRENCY}")
+    print(f"Task tracking: {TASK_TRACKING} (most recent {TASK_LIMIT})")
+    threading.Thread(target=_refresher, daemon=True).start()
+    httpserver.serve(StatsHandler, PORT)
@@ -0,0 +1,265 @@
+"""Prometheus exposition formats for the exporters and proxies.
+
+Servers describe their output as samples of declared metric families and
+let the scraper's Accept header pick the format:
+
+- Prometheus text 0.0.4 (the default)
+- OpenMetrics text 1.0.0
+- Prometheus protobuf, length-delimited MetricFamily messages
+
+    DOCS = exposition.Family("paperless_documents_total", "gauge", "Total number of documents")
+    fmt = exposition.negotiate(self.headers.get("Accept"))
+    body = exposition.render([(DOCS, (), 42)], fmt, timestamp=collected_at)
+
+Histogram samples take a `(buckets, sum, count)` value, where `buckets` is
+a sequence of (upper bound, cumulative count) pairs without the +Inf
+bucket.
+
+Each family's HELP/TYPE header is rendered once per format and reused.
+`timestamp` (Unix seconds) marks when the upstream data was read, so a
+cached reading is stored at the time it was taken rather than at scrape
+time; omit it for data fetched during the scrape. Get it from a
+`SourceClock`, which stops stamping readings old enough to fall out of
+Prometheus' lookback:
+
+    ts = _clock.timestamp(stats["collected_at"])  # None once too old
+    body = exposition.render(samples, fmt, timestamp=ts)
+
+Standard library only; the protobuf messages are encoded by hand.
+"""
+
+import math
+import struct
+import threading
+import time
+
+PROTOBUF_TYPES = {"counter": 0, "gauge": 1, "summary": 2, "untyped": 3, "histogram": 4}
+# Metric message field carrying the value for each type (summaries are not supported)
+_PROTOBUF_VALUE_FIELDS = {"counter": 3, "gauge": 2, "untyped": 5, "histogram": 7}
+
+
+# Prometheus leaves samples older than its 5-minute lookback out of instant queries; readings
+# older than this are rendered at scrape time instead
+SOURCE_TIMESTAMP_MAX_AGE = 240
+
+
+class SourceClock:
+    """Source timestamps for one server's cached readings.
+
+    A reading is stamped with the time it was taken while that is at most
+    `max_age` seconds ago, and rendered without a timestamp (scrape time)
+    after that. Once a scrape has gone out unstamped, later readings are
+    stamped no earlier than a second after it, so Prometheus never sees a
+    sample older than one it already stored (rejected as out of order).
+    """
+
+    def __init__(self, max_age=SOURCE_TIMESTAMP_MAX_AGE):
+        self.max_age = max_age
+        self._floor = 0.0  # time of the last unstamped render
+        self._lock = threading.Lock()
+
+    def timestamp(self, collected_at):
+        """Timestamp for samples of a reading taken at `collected_at`, or None for scrape time."""
+        now = time.time()
+        with self._lock:
+            if not collected_at or now - collected_at > self.max_age:
+                self._floor = now
+                return None
+            return max(collected_at, self._floor + 1)
+
+
+class Format:
+    """One exposition format: its media type and the bytes that end a body."""
+
+    def __init__(self, name, content_type, terminator=b""):
+        self.name = name
+        self.content_type = content_type
+        self.terminator = terminator
+
+    def __repr__(self):
+        return f"Format({self.name!r})"
+
+
+TEXT = Format("text", "text/plain; version=0.0.4; charset=utf-8")
+OPENMETRICS = Format("openmetrics", "application/openmetrics-text; version=1.0.0; charset=utf-8", b"# EOF\n")
+PROTOBUF = Format(
+    "protobuf",
+    "application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited",
+)
+
+
+def negotiate(accept):
+    """Pick the exposition format for an Accept header (TEXT when nothing better matches)."""
+    best, best_q = TEXT, 0.0
+    for media_range in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        params = dict(param.partition("=")[::2] for param in params)
+        try:
+            q = float(params.get("q", "1"))
+        except ValueError:
+            continue
+        media_type = media_type.lower()
+        if media_type == "application/openmetrics-text":
+            fmt = OPENMETRICS
+        elif (
+            media_type == "application/vnd.google.protobuf"
+            and params.get("proto") == "io.prometheus.client.MetricFamily"
+            and params.get("encoding") == "delimited"
+        ):
+            fmt = PROTOBUF
+        elif media_type in ("text/plain", "*/*"):
+            fmt = TEXT
+        else:
+            continue
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    value = float(value) if isinstance(value, bool) else value
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+    return str(value)
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _pb_bytes(field, data):
+    return _varint(field << 3 | 2) + _varint(len(data)) + data
+
+
+def _pb_string(field, text):
+    return _pb_bytes(field, text.encode())
+
+
+def _pb_double(field, value):
+    return _varint(field << 3 | 1) + struct.pack("<d", float(value))
+
+
+def _pb_uint(field, value):
+    return _varint(field << 3) + _varint(int(value))
+
+
+class Family:
+    """A metric family (name, type, HELP) with its headers pre-rendered per format.
+
+    `type` is "gauge", "counter", "histogram" or "untyped". Counters should
+    be named with a `_total` suffix so the series name is the same in every
+    format.
+    """
+
+    __slots__ = ("name", "type", "help", "_headers")
+
+    def __init__(self, name, type, help):
+        if type not in _PROTOBUF_VALUE_FIELDS:
+            raise ValueError(f"unsupported metric type {type!r}")
+        self.name = name
+        self.type = type
+        self.help = help
+        self._headers = {}
+
+    def header(self, fmt):
+        """HELP/TYPE header for `fmt`, rendered on first use."""
+        header = self._headers.get(fmt.name)
+        if header is None:
+            header = self._headers[fmt.name] = self._render_header(fmt)
+        return header
+
+    def _render_header(self, fmt):
+        if fmt is PROTOBUF:
+            return (
+                _pb_string(1, self.name)
+                + _pb_string(2, self.help)
+                + _varint(3 << 3)
+                + _varint(PROTOBUF_TYPES[self.type])
+            )
+        if fmt is OPENMETRICS:
+            name, type_ = self.name, self.type
+            if type_ == "counter" and name.endswith("_total"):
+                name = name[: -len("_total")]
+            elif type_ not in ("gauge", "histogram"):
+                type_ = "unknown"
+            help_text = _escape_help(self.help).replace('"', '\\"')
+            return f"# HELP {name} {help_text}\n# TYPE {name} {type_}\n".encode()
+        return f"# HELP {self.name} {_escape_help(self.help)}\n# TYPE {self.name} {self.type}\n".encode()
+
+
+def _text_family(family, series, fmt, timestamp):
+    if timestamp is None:
+        suffix = "\n"
+    elif fmt is OPENMETRICS:
+        suffix = f" {timestamp:.3f}\n"
+    else:
+        suffix = f" {int(timestamp * 1000)}\n"
+    lines = [family.header(fmt)]
+    for labels, value in series:
+        label_str = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels)
+        if family.type == "histogram":
+            buckets, total, count = value
+            sep = "," if label_str else ""
+            for bound, cumulative in buckets:
+                le = _format_value(float(bound))
+                lines.append(f'{family.name}_bucket{{{label_str}{sep}le="{le}"}} {cumulative}{suffix}'.encode())
+            lines.append(f'{family.name}_bucket{{{label_str}{sep}le="+Inf"}} {count}{suffix}'.encode())
+            labels_part = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{family.name}_sum{labels_part} {_format_value(float(total))}{suffix}".encode())
+            lines.append(f"{family.name}_count{labels_part} {count}{suffix}".encode())
+            continue
+        name = f"{family.name}{{{label_str}}}" if label_str else family.name
+        lines.append(f"{name} {_format_value(value)}{suffix}".encode())
+    return b"".join(lines)
+
+
+def _protobuf_family(family, series, timestamp):
+    value_field = _PROTOBUF_VALUE_FIELDS[family.type]
+    timestamp_field = b"" if timestamp is None else _varint(6 << 3) + _varint(int(timestamp * 1000))
+    metrics = []
+    for labels, value in series:
+        metric = b"".join(_pb_bytes(1, _pb_string(1, key) + _pb_string(2, str(val))) for key, val in labels)
+        if family.type == "histogram":
+            # The +Inf bucket is implied by sample_count
+            buckets, total, count = value
+            histogram = _pb_uint(1, count) + _pb_double(2, total)
+            histogram += b"".join(_pb_bytes(3, _pb_uint(1, c) + _pb_double(2, bound)) for bound, c in buckets)
+            metric += _pb_bytes(value_field, histogram)
+        else:
+            metric += _pb_bytes(value_field, _pb_double(1, value))
+        metrics.append(_pb_bytes(4, metric + timestamp_field))
+    message = family.header(PROTOBUF) + b"".join(metrics)
+    return _varint(len(message)) + message
+
+
+def render(samples, fmt, timestamp=None):
+    """Render (family, labels, value) samples in `fmt`.
+
+    `labels` is a sequence of (name, value) pairs. Samples are grouped per
+    family in order of first appearance. The format's terminator (OpenMetrics'
+    `# EOF`) is not included, so bodies rendered separately can be
+    concatenated; finish the response with `fmt.terminator`.
+    """
+    by_family = {}
+    for family, labels, value in samples:
+        by_family.setdefault(family, []).append((labels, value))
+
+    if fmt is PROTOBUF:
+        return b"".join(_protobuf_family(family, series, timestamp) for family, series in by_family.items())
+    return b"".join(_text_family(family, series, fmt, timestamp) for family, series in by_family.items())
@@ -0,0 +1,201 @@
+"""Shared keep-alive HTTP client for the exporters and proxies.
+
+Connections are pooled per upstream host and reused across calls and
+threads, so a scrape pays the TCP (and TLS) handshake once rather than on
+every request. GET requests can be made conditional: the last ETag /
+Last-Modified and body are remembered per path, and a 304 reply returns
+the remembered body without downloading it again.
+
+Standard library only. Copied next to each server.py at image build time
+via the `shared` build context (see ADR-039).
+"""
+
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+import selfmetrics
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 4
+MAX_VALIDATORS = 256  # remembered conditional-GET responses per client
+
+# Errors that mean a pooled connection was closed by the server while idle
+_STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class HTTPError(Exception):
+    """Raised when an upstream answers with a 4xx/5xx status."""
+
+    def __init__(self, method, url, status, reason):
+        super().__init__(f"{method} {url} returned HTTP {status} {reason}")
+        self.status = status
+
+
+class Response:
+    """A fully read response."""
+
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class _HostPool:
+    """Idle keep-alive connections to one scheme://host:port."""
+
+    def __init__(self, scheme, netloc, size):
+        self._conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self._netloc = netloc
+        self._idle = []
+        self._lock = threading.Lock()
+        self.size = size
+
+    def acquire(self, timeout, fresh=False):
+        """Return (connection, reused) with the socket timeout set to `timeout`.
+
+        `fresh=True` skips the idle connections and always opens a new one.
+        """
+        conn = None
+        if not fresh:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return self._conn_cls(self._netloc, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_for(scheme, netloc, size):
+    with _pools_lock:
+        pool = _pools.get((scheme, netloc))
+        if pool is None:
+            pool = _pools[(scheme, netloc)] = _HostPool(scheme, netloc, size)
+        pool.size = max(pool.size, size)
+        return pool
+
+
+class Client:
+    """HTTP client bound to one upstream base URL.
+
+    `headers` are sent with every request; per-call headers are merged on
+    top. `timeout` is the default per-call socket timeout in seconds, and
+    `pool_size` the number of idle connections kept for the upstream host.
+    """
+
+    def __init__(self, base_url, headers=None, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url.rstrip("/")
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self._prefix = parts.path.rstrip("/")
+        self._upstream = parts.netloc
+        self._pool = _pool_for(parts.scheme or "http", parts.netloc, pool_size)
+        self._validators = {}  # path -> (etag, last_modified, body)
+        self._validators_lock = threading.Lock()
+
+    def _send(self, method, path, body, headers, timeout):
+        """Send a request, retrying once on a new connection if a reused one had gone stale."""
+        merged = {**self.headers, **(headers or {})}
+        for attempt in range(2):
+            conn, reused = self._pool.acquire(self.timeout if timeout is None else timeout, fresh=attempt > 0)
+            try:
+                conn.request(method, f"{self._prefix}{path}", body=body, headers=merged)
+                return conn, conn.getresponse()
+            except _STALE_ERRORS:
+                conn.close()
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+    @contextmanager
+    def stream(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request and yield the open response for incremental reading.
+
+        The connection goes back to the pool only if the body was read to
+        the end; otherwise it is closed. The call's duration, until the
+        response is closed, and any failure are recorded in selfmetrics.
+        """
+        start = time.perf_counter()
+        failed = False
+        try:
+            conn, resp = self._send(method, path, body, headers, timeout)
+            try:
+                if resp.status >= 400:
+                    raise HTTPError(method, f"{self.base_url}{path}", resp.status, resp.reason)
+                yield resp
+            finally:
+                if resp.isclosed():
+                    self._pool.release(conn)
+                else:
+                    conn.close()
+        except (HTTPError, OSError, http.client.HTTPException):
+            failed = True
+            raise
+        finally:
+            selfmetrics.observe_upstream(self._upstream, f"{self._prefix}{path}", time.perf_counter() - start, failed)
+
+    def request(self, method, path, body=None, headers=None, timeout=None, conditional=False):
+        """Send a request and return the fully read Response.
+
+        With `conditional=True` (GET only) the request carries the validators
+        of the last response for `path`; a 304 reply is returned with
+        status 304 and the remembered body.
+        """
+        headers = dict(headers or {})
+        cached = None
+        if conditional:
+            with self._validators_lock:
+                cached = self._validators.get(path)
+            if cached:
+                etag, last_modified, _ = cached
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+
+        with self.stream(method, path, body, headers, timeout) as resp:
+            data = resp.read()
+
+        if resp.status == 304 and cached:
+            return Response(304, resp.headers, cached[2])
+        if conditional:
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                with self._validators_lock:
+                    self._validators.pop(path, None)
+                    if len(self._validators) >= MAX_VALIDATORS:
+                        self._validators.pop(next(iter(self._validators)))
+                    self._validators[path] = (etag, last_modified, data)
+        return Response(resp.status, resp.headers, data)
+
+    def get_json(self, path, headers=None, timeout=None, conditional=True):
+        """GET `path` and decode the JSON body."""
+        return self.request("GET", path, headers=headers, timeout=timeout, conditional=conditional).json()
+
+    def head(self, path, headers=None, timeout=None):
+        return self.request("HEAD", path, headers=headers, timeout=timeout)
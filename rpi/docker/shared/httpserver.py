@@ -0,0 +1,247 @@
+"""Shared HTTP server core for the exporters and proxies.
+
+Requests are handled on their own threads, so one slow /metrics (a storage
+scan, an upstream hitting its timeout) no longer blocks /health, Homepage's
+/ request or the other Prometheus replica. At most MAX_IN_FLIGHT requests
+run at once; excess requests get an immediate 503 instead of queueing.
+Paths listed in a handler's `cheap_paths` never count against the limit;
+every handler answers /health through `send_health()`.
+
+Handlers subclass `RequestHandler` instead of BaseHTTPRequestHandler and
+are started with `serve(HandlerClass, PORT)`.
+
+Response bodies go out through `send_rendered()`, which honors
+`If-None-Match` and `Accept-Encoding: gzip`. `RenderCache` keeps each
+rendered body (and its gzip form) until the underlying data version
+changes, so unchanged data is neither re-rendered nor re-compressed.
+Metrics endpoints use `metrics_format()` / `send_metrics()` to answer in
+the exposition format the scraper asked for (see exposition.py).
+
+Every request's duration is recorded in selfmetrics under its path if the
+handler lists it in `routes`, or as path="other" (unrouted paths, and
+requests too malformed to have one) so the label stays bounded.
+`send_metrics()` appends the self-instrumentation metrics on the handler's
+`self_metrics_paths` (/metrics by default).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import exposition
+import selfmetrics
+
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "8"))
+GZIP_MIN_BYTES = 512  # smaller bodies are sent uncompressed
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class Rendered:
+    """A rendered response body with its ETag and lazily built gzip form.
+
+    The gzip compressor is kept unflushed so a short dynamic tail (e.g. an
+    age gauge) can be appended per request by compressing only the tail.
+    """
+
+    __slots__ = ("body", "version", "etag", "_gzip_prefix", "_compressor")
+
+    def __init__(self, body, version=None):
+        self.body = body
+        self.version = version
+        self.etag = _digest(body)
+        self._gzip_prefix = None
+        self._compressor = None
+
+    def gzipped(self, tail=b""):
+        if self._compressor is None:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+            self._gzip_prefix = compressor.compress(self.body)
+            self._compressor = compressor
+        compressor = self._compressor.copy()
+        return self._gzip_prefix + compressor.compress(tail) + compressor.flush()
+
+
+class RenderCache:
+    """Rendered bodies keyed by name, rebuilt only when the data version changes.
+
+    A version is any value compared with ==, typically the cached snapshot
+    the body is rendered from.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, version, render):
+        """Return the Rendered body for `key`, calling render() -> bytes only on a new version."""
+        with self._lock:
+            entry = self._entries.get(key)
+        hit = entry is not None and entry.version == version
+        selfmetrics.cache_lookup("render", hit)
+        if hit:
+            return entry
+        entry = Rendered(render(), version)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+
+def _accepts_gzip(header):
+    """Whether an Accept-Encoding header allows gzip (explicitly or via *).
+
+    A q value that does not parse counts as q=0, so a malformed header gets
+    the uncompressed body rather than an error.
+    """
+    weights = {}
+    for part in (header or "").split(","):
+        coding, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights.setdefault(coding.strip().lower(), q)
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+
+class BoundedHTTPServer(ThreadingHTTPServer):
+    """Thread-per-request server that tracks a fixed number of request slots."""
+
+    daemon_threads = True
+
+    def __init__(self, address, handler_cls, max_in_flight=MAX_IN_FLIGHT):
+        super().__init__(address, handler_cls)
+        self.max_in_flight = max_in_flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Base handler that enforces the server's in-flight limit.
+
+    `cheap_paths` are answered without taking a slot, so they stay
+    responsive even while every slot is busy. `self_metrics_paths` are the
+    metrics endpoints that also carry the self-instrumentation metrics, and
+    `routes` the paths the handler serves (request durations of any other
+    path are recorded as path="other").
+    """
+
+    cheap_paths = frozenset({"/health"})
+    self_metrics_paths = frozenset({"/metrics"})
+    routes = frozenset({"/health", "/metrics"})
+
+    def parse_request(self):
+        self._start = time.perf_counter()
+        if not super().parse_request():
+            return False
+        path = urllib.parse.urlsplit(self.path).path
+        if path in self.routes:
+            self._route = path
+        if path in self.cheap_paths:
+            return True
+        if not self.server.slots.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(b"too many requests in flight\n")
+            return False
+        self._slot = True
+        return True
+
+    def handle_one_request(self):
+        # Reset per request: a 414 fails before parse_request(), a bad version before the path is set
+        self._slot = False
+        self._start = None
+        self._status = None
+        self._route = "other"
+        try:
+            super().handle_one_request()
+        finally:
+            if self._slot:
+                self._slot = False
+                self.server.slots.release()
+            if self._status is not None and self._start is not None:
+                selfmetrics.observe_request(self._route, time.perf_counter() - self._start)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def health_status(self):
+        """Status reported by /health; override to reflect the handler's data."""
+        return "ok"
+
+    def send_health(self):
+        """Answer /health with {"status": health_status()}, without touching any upstream."""
+        body = json.dumps({"status": self.health_status()}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", JSON_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_rendered(self, rendered, content_type, tail=b"", status=200):
+        """Send a Rendered body (plus an optional uncached tail).
+
+        Answers 304 when If-None-Match carries the current ETag, and
+        gzip-compresses bodies of GZIP_MIN_BYTES or more for clients that
+        accept it.
+        """
+        etag = f'"{rendered.etag}-{_digest(tail)}"' if tail else f'"{rendered.etag}"'
+        if status == 200:
+            candidates = {tag.strip().removeprefix("W/") for tag in self.headers.get("If-None-Match", "").split(",")}
+            if etag in candidates or "*" in candidates:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+        use_gzip = len(rendered.body) + len(tail) >= GZIP_MIN_BYTES and _accepts_gzip(
+            self.headers.get("Accept-Encoding")
+        )
+        body = rendered.gzipped(tail) if use_gzip else rendered.body + tail
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept, Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def metrics_format(self):
+        """Exposition format negotiated from the request's Accept header."""
+        return exposition.negotiate(self.headers.get("Accept"))
+
+    def send_metrics(self, rendered, fmt, tail=b""):
+        """Send a body rendered with exposition.render() in `fmt`, adding the format's terminator.
+
+        On `self_metrics_paths` the self-instrumentation metrics are added
+        to the tail.
+        """
+        if urllib.parse.urlsplit(self.path).path in self.self_metrics_paths:
+            tail += selfmetrics.render(fmt)
+        self.send_rendered(rendered, fmt.content_type, tail + fmt.terminator)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler_cls, port, max_in_flight=MAX_IN_FLIGHT):
+    """Serve `handler_cls` on all interfaces until the process exits."""
+    server = BoundedHTTPServer(("0.0.0.0", port), handler_cls, max_in_flight)
+    server.serve_forever()
@@ -0,0 +1,84 @@
+"""Incremental decoding of JSON arrays from HTTP responses.
+
+`iter_array()` reads a response in chunks and yields each element of a
+JSON array as soon as it is complete, so memory holds one chunk and one
+element rather than the whole body. The array is either the whole body or,
+with `key`, the value of the first `"key": [` in an object body:
+
+    with client.stream("GET", "/api/tasks/") as resp:
+        for task in jsonstream.iter_array(resp, key="results"):
+            ...
+
+If the caller stops early, closing the stream closes the connection
+instead of draining it.
+"""
+
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\r\n"
+
+
+def iter_array(resp, key=None, source="response", chunk_size=CHUNK_SIZE):
+    """Yield the elements of the JSON array in `resp` one at a time.
+
+    A body that is an array is streamed as is. An object body is searched
+    for `"key": [` and that array streamed; without `key` it is an error.
+    `source` names the response in ValueError messages.
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    decoder = json.JSONDecoder()
+    text, pos, eof = "", 0, False
+
+    def read():
+        nonlocal eof
+        chunk = resp.read(chunk_size)
+        eof = not chunk
+        return utf8.decode(chunk, final=eof)
+
+    # Find where the array starts
+    while True:
+        body_start = len(text) - len(text.lstrip(_WHITESPACE))
+        if body_start < len(text):
+            break
+        if eof:
+            raise ValueError(f"{source} was empty")
+        text = read()
+    if text[body_start] == "[":
+        pos = body_start + 1
+    elif text[body_start] == "{" and key is not None:
+        key_start = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+        keep = len(key) + 32  # enough to match a key split across chunks
+        while True:
+            match = key_start.search(text)
+            if match:
+                pos = match.end()
+                break
+            if eof:
+                raise ValueError(f"{source} has no {key!r} array")
+            text = text[-keep:] + read()
+    else:
+        raise ValueError(f"{source} is not a JSON array")
+
+    # Decode elements as they complete
+    while True:
+        while pos < len(text) and (text[pos] in _WHITESPACE or text[pos] == ","):
+            pos += 1
+        if pos < len(text) and text[pos] == "]":
+            resp.read()
+            return
+        if pos < len(text):
+            try:
+                element, pos = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield element
+                continue
+        if eof:
+            raise ValueError(f"{source} ended inside a JSON array")
+        text = text[pos:] + read()
+        pos = 0
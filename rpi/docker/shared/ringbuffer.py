@@ -0,0 +1,49 @@
+"""Fixed-size numeric ring buffers backed by `array`.
+
+Used for in-memory sample history (sub-scrape sampling, queue drain
+rates). Storage is one preallocated array of C doubles per buffer, so
+memory is fixed at creation time no matter how long the process runs.
+"""
+
+import math
+from array import array
+
+
+class RingBuffer:
+    """Holds the most recent `capacity` float samples."""
+
+    __slots__ = ("_data", "_capacity", "_next", "_count")
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self._data = array("d", bytes(8 * capacity))
+        self._capacity = capacity
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+
+    def values(self):
+        """Return the samples oldest first."""
+        if self._count < self._capacity:
+            return self._data[:self._count]
+        return self._data[self._next:] + self._data[:self._next]
+
+    def summary(self):
+        """Return (min, max, avg, p95) of the held samples, or None if empty.
+
+        p95 uses the nearest-rank method.
+        """
+        if not self._count:
+            return None
+        ordered = sorted(self._data[:self._count])
+        n = len(ordered)
+        return ordered[0], ordered[-1], math.fsum(ordered) / n, ordered[math.ceil(0.95 * n) - 1]
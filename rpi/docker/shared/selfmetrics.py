@@ -0,0 +1,191 @@
+"""Self-instrumentation shared by the exporters and proxies.
+
+Each server reports its own behavior alongside its metrics:
+
+- exporter_request_duration_seconds{path}: time to answer each endpoint
+- exporter_upstream_request_duration_seconds{upstream,endpoint} and
+  exporter_upstream_errors_total{upstream,endpoint}: every httpclient call
+- exporter_task_duration_seconds{task}: work timed with `timer()`, such as
+  a background refresh
+- exporter_cache_requests_total{cache,result} and exporter_cache_age_seconds{cache}
+- process_cpu_seconds_total, process_resident_memory_bytes,
+  process_start_time_seconds
+
+httpserver and httpclient record requests and upstream calls on their own;
+servers add cache lookups and timed tasks:
+
+    selfmetrics.cache_lookup("stats", hit=_cache["data"] is not None)
+    selfmetrics.cache_age("stats", lambda: time.time() - _cache["timestamp"])
+    with selfmetrics.timer("storage"):
+        ...
+
+httpserver appends render(fmt) to /metrics. Recording is a dict lookup, a
+bisect and a lock per observation; SELF_METRICS=0 turns it all off.
+"""
+
+import bisect
+import os
+import re
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+import exposition
+
+ENABLED = os.environ.get("SELF_METRICS", "1") != "0"
+# Seconds; wide enough for a 5ms Glances call and a multi-minute Paperless storage scan
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_START_TIME = time.time()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# Path segments that are ids (numbers, UUIDs, hex digests), collapsed so endpoints stay a small set;
+# the number in /api/<version>/ (Glances' /api/4/cpu) is kept
+_ID_SEGMENT = re.compile(r"(?<!/api)/(?:\d+|[0-9a-fA-F-]{32,36})(?=/|$)")
+
+REQUEST_DURATION = exposition.Family(
+    "exporter_request_duration_seconds", "histogram", "Time to answer requests to this server, by path"
+)
+UPSTREAM_DURATION = exposition.Family(
+    "exporter_upstream_request_duration_seconds", "histogram", "Duration of upstream HTTP calls, by endpoint"
+)
+UPSTREAM_ERRORS = exposition.Family(
+    "exporter_upstream_errors_total", "counter", "Upstream HTTP calls that failed or returned 4xx/5xx, by endpoint"
+)
+TASK_DURATION = exposition.Family("exporter_task_duration_seconds", "histogram", "Duration of timed internal work")
+CACHE_REQUESTS = exposition.Family(
+    "exporter_cache_requests_total", "counter", "Cache lookups by cache and result (hit or miss)"
+)
+CACHE_AGE = exposition.Family("exporter_cache_age_seconds", "gauge", "Age of the data currently held in each cache")
+CPU_SECONDS = exposition.Family("process_cpu_seconds_total", "counter", "User and system CPU time spent in seconds")
+RSS_BYTES = exposition.Family("process_resident_memory_bytes", "gauge", "Resident memory size in bytes")
+START_TIME = exposition.Family("process_start_time_seconds", "gauge", "Unix time the process started")
+
+
+class Histogram:
+    """Per-label-set bucket counts for one histogram family."""
+
+    def __init__(self, family, buckets=BUCKETS):
+        self.family = family
+        self.buckets = buckets
+        self._series = {}  # labels -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        result = []
+        for labels, counts, total in series:
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            result.append((self.family, labels, (buckets, round(total, 6), cumulative + counts[-1])))
+        return result
+
+
+class Counter:
+    """Per-label-set counts for one counter family."""
+
+    def __init__(self, family):
+        self.family = family
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._counts[labels] = self._counts.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.family, labels, count) for labels, count in self._counts.items()]
+
+
+_requests = Histogram(REQUEST_DURATION)
+_upstream = Histogram(UPSTREAM_DURATION)
+_upstream_errors = Counter(UPSTREAM_ERRORS)
+_tasks = Histogram(TASK_DURATION)
+_cache_requests = Counter(CACHE_REQUESTS)
+_cache_ages = {}  # cache name -> callable returning its age in seconds (None while empty)
+
+
+def endpoint(path):
+    """Normalize a request path for use as a label: no query string, id segments collapsed."""
+    return _ID_SEGMENT.sub("/:id", path.split("?", 1)[0]) or "/"
+
+
+def observe_request(path, seconds):
+    if ENABLED:
+        _requests.observe((("path", path),), seconds)
+
+
+def observe_upstream(upstream, path, seconds, error=False):
+    if not ENABLED:
+        return
+    labels = (("upstream", upstream), ("endpoint", endpoint(path)))
+    _upstream.observe(labels, seconds)
+    if error:
+        _upstream_errors.inc(labels)
+
+
+def cache_lookup(cache, hit):
+    """Count one lookup of `cache` as a hit or a miss."""
+    if ENABLED:
+        _cache_requests.inc((("cache", cache), ("result", "hit" if hit else "miss")))
+
+
+def cache_age(cache, age):
+    """Report `age()` (seconds, or None while the cache is empty) as the age of `cache`."""
+    _cache_ages[cache] = age
+
+
+@contextmanager
+def timer(task):
+    """Time the enclosed block as `task`, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if ENABLED:
+            _tasks.observe((("task", task),), time.perf_counter() - start)
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, in KiB on Linux
+
+
+def samples():
+    """All self-instrumentation samples."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result = [
+        (CPU_SECONDS, (), round(usage.ru_utime + usage.ru_stime, 3)),
+        (RSS_BYTES, (), _rss_bytes()),
+        (START_TIME, (), round(_START_TIME, 3)),
+    ]
+    result += _requests.samples() + _upstream.samples() + _upstream_errors.samples() + _tasks.samples()
+    result += _cache_requests.samples()
+    for cache, age in list(_cache_ages.items()):
+        value = age()
+        if value is not None:
+            result.append((CACHE_AGE, (("cache", cache),), round(value, 1)))
+    return result
+
+
+def render(fmt):
+    """Self-instrumentation metrics in `fmt` (empty when disabled)."""
+    if not ENABLED:
+        return b""
+    return exposition.render(samples(), fmt)
@@ -0,0 +1,41 @@
+"""Coalescing of concurrent cache refreshes into one upstream call.
+
+A server whose cached data expires under concurrent requests should only
+refresh it once:
+
+    _refresh = singleflight.SingleFlight()
+
+    def _get_stats():
+        if fresh:
+            return _cache["data"]
+        return _refresh.run(_compute_and_store_stats)
+
+Callers that arrive while a refresh is running wait for it and get its
+result instead of starting another one.
+"""
+
+import threading
+import time
+
+
+class SingleFlight:
+    """Runs at most one refresh at a time and shares its result with the callers that waited."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._result = None
+        self._finished = None  # time.time() the last successful refresh finished
+
+    def run(self, refresh):
+        """Return refresh(), or the result of a refresh that finished after this call began.
+
+        A refresh that raises is not shared; the next caller in line tries
+        again.
+        """
+        requested = time.time()
+        with self._lock:
+            if self._finished is not None and self._finished >= requested:
+                return self._result
+            result = refresh()
+            self._result, self._finished = result, time.time()
+            return result